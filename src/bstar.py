@@ -10,14 +10,15 @@ class Bstar:
     # Takes in a filepath or raw bytes as input
     # If passing in raw bytes, please also provide a filename
     def __init__(self, data, filename=''):
-        if type(data) != bytes:
+        owns_data = False
+        if isinstance(data, (str, os.PathLike)):
             if os.path.splitext(data)[1] in ['.json', '.yml', '.yaml', '.txt']:
                 self.filename = os.path.basename(os.path.splitext(data)[0])
             else:
                 self.filename = os.path.basename(data)
             if os.path.splitext(data)[1] == '.bstar':
-                with open(data, 'rb') as file:
-                    data = file.read()
+                data = map_file(data)
+                owns_data = True
             elif os.path.splitext(data)[1] == '.json':
                 with open(data, 'r') as file:
                     self.entries = json.load(file)["Entries"]
@@ -42,7 +43,7 @@ class Bstar:
             if os.path.splitext(filename)[1] != '.bstar':
                 filename += '.bstar'
             self.filename = filename
-        self.stream = ReadStream(data)
+        self.stream = ReadStream(data, owns_data)
 
         self.magic = self.stream.read(4).decode('utf-8')
         assert self.magic == "STAR", f"Invalid file magic, expected 'STAR' but got '{self.magic}'"
@@ -53,18 +54,23 @@ class Bstar:
         self.entries = []
         for i in range (self.count):
             self.entries.append(self.stream.read_string())
+        self.stream.close()
         return
     
     # Converts Bstar object into .bstar file
     def Serialize(self, output_dir=''):
         with open(os.path.join(output_dir, self.filename), 'wb') as outfile:
-            buffer = WriteStream(outfile)
+            outfile.write(self.ToBytes())
 
-            buffer.write(string(self.magic))
-            buffer.write(u32(self.version))
-            buffer.write(u32(len(self.entries)))
-            for entry in self.entries:
-                buffer.write(string(entry) + b'\x00')
+    # Serializes the Bstar object in memory and returns the file as bytes
+    def ToBytes(self):
+        buffer = WriteStream()
+        buffer.write(string(self.magic))
+        buffer.write(u32(self.version))
+        buffer.write(u32(len(self.entries)))
+        for entry in self.entries:
+            buffer.write(string(entry) + b'\x00')
+        return buffer.getvalue()
 
     # Converts Bstar object into .json file
     def ToJson(self, output_dir=''):
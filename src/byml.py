@@ -1,6 +1,11 @@
 from utils import *
 import os
+import struct
+import bisect
+import re
 import json
+import pipeline
+from collections.abc import Mapping, Sequence
 try:
     import yaml
 except ImportError:
@@ -65,8 +70,12 @@ def add_constructors(loader):
     yaml.add_constructor(u'!f64', lambda l, node: Double(l.construct_yaml_float(node)), Loader=loader)
 
 class Byml:
-    def __init__(self, data, filename=''):
-        if type(data) != bytes:
+    # If lazy is set, arrays, dictionaries, and string tables are only decoded as they're accessed (see LazyDictionary)
+    # Lazy documents are read-only and keep the data open until Materialize() is called
+    def __init__(self, data, filename='', lazy=False):
+        self.lazy = lazy
+        owns_data = False
+        if isinstance(data, (str, os.PathLike)):
             self.filename = os.path.basename(data)
             if os.path.splitext(self.filename)[1] in ['.yml', '.yaml']:
                 with open(data, 'r', encoding='utf-8') as file:
@@ -75,14 +84,15 @@ class Byml:
                     self.root_node = yaml.load(file, Loader=loader)
                     self.magic = 'YB'
                     self.version = 7
+                    self.lazy = False # Already fully loaded
                     return
             elif os.path.splitext(self.filename)[1] in ['.byml', '.byaml', '.bgyml']:
-                with open(data, 'rb') as file:
-                    data = file.read()
+                data = map_file(data)
+                owns_data = True
         else:
             self.filename = filename
 
-        self.stream = ReadStream(data)
+        self.stream = ReadStream(data, owns_data)
 
         self.magic = self.stream.read(2).decode('utf-8')
         if self.magic not in ['BY', 'YB']:
@@ -113,40 +123,60 @@ class Byml:
             self.root_node = self.ParseNode()
         else:
             self.root_node = {}
+        if not(self.lazy):
+            self.stream.close()
+
+    # Decodes the rest of a lazy document into regular dicts and lists so it can be edited and saved
+    # Proxies taken from the document before this can't be used afterwards since the data is closed
+    def Materialize(self):
+        if self.lazy:
+            self.root_node = Materialize(self.root_node)
+            self.key_table = list(self.key_table)
+            self.string_table = list(self.string_table)
+            self.lazy = False
+            self.stream.close()
+        return self.root_node
+
+    def CheckEager(self):
+        if self.lazy:
+            raise ValueError(f"{self.filename} was loaded lazily, call Materialize() before converting it")
 
     def ToYaml(self):
+        self.CheckEager()
         dumper = yaml.Dumper
         add_representers(dumper)
         with open(self.filename + '.yml', 'w') as file:
             yaml.dump(self.root_node, file, sort_keys=False, allow_unicode=True, Dumper=dumper)
 
     def ToJson(self):
+        self.CheckEager()
         with open(self.filename + '.json', 'w') as file:
             json.dump(self.root_node, file, indent=4)
 
     # lazy reserialization for now, hopefully will work on getting all node types for later
     def Reserialize(self, output_dir=''):
-        with open(os.path.join(output_dir, self.filename), 'wb+') as f:
-            buffer = WriteStream(f)
-            buffer.write(self.magic.encode())
-            buffer.write(u16(self.version, self.bom))
-            buffer.skip(12)
-            self.key_table, self.string_table = [], []
-            self.GenerateStringTables(self.root_node)
-            key_table_offset = buffer.tell()
-            self.key_table.sort()
-            self.WriteStringTable(self.key_table, buffer)
-            string_table_offset = buffer.tell()
-            self.string_table.sort()
-            self.WriteStringTable(self.string_table, buffer)
-            root_node_offset = buffer.tell()
-            nodes = {}
-            self.WriteNode(self.root_node, nodes, buffer)
-
-            buffer.seek(4)
-            buffer.write(u32(key_table_offset, self.bom))
-            buffer.write(u32(string_table_offset, self.bom))
-            buffer.write(u32(root_node_offset, self.bom))
+        with open(os.path.join(output_dir, self.filename), 'wb') as f:
+            f.write(self.ToBytes())
+
+    # Serializes the document in memory and returns the file as bytes
+    def ToBytes(self):
+        self.CheckEager()
+        buffer = WriteStream()
+        buffer.write(self.magic.encode())
+        buffer.write(u16(self.version, self.bom))
+        buffer.skip(12)
+        self.GenerateStringTables(self.root_node)
+        key_table_offset = buffer.tell()
+        self.WriteStringTable(self.key_table, buffer)
+        string_table_offset = buffer.tell()
+        self.WriteStringTable(self.string_table, buffer)
+        root_node_offset = buffer.tell()
+        self.node_ids = self.HashNodes(self.root_node)
+        nodes = {}
+        self.WriteNode(self.root_node, nodes, buffer)
+
+        buffer.patch(4, u32(key_table_offset, self.bom) + u32(string_table_offset, self.bom) + u32(root_node_offset, self.bom))
+        return buffer.getvalue()
 
     def WriteNode(self, node, nodes, buffer):
         nonvalue_nodes = []
@@ -159,7 +189,7 @@ class Byml:
             buffer.align_up(4)
             for item in node:
                 if self.IsValue(item):
-                    buffer.write(self.FormatValue(item, self.string_table, self.bom))
+                    buffer.write(self.FormatValue(item, self.string_indices, self.bom))
                 else:
                     nonvalue_nodes.append((item, buffer.tell()))
                     buffer.write(u32(0))
@@ -169,10 +199,10 @@ class Byml:
             buffer.write(u24(len(node), self.bom))
             for key in sorted(node.keys()):
                 value = node[key]
-                buffer.write(u24(self.key_table.index(key), self.bom))
+                buffer.write(u24(self.key_indices[key], self.bom))
                 buffer.write(u8(self.GetNodeType(value)))
                 if self.IsValue(value):
-                    buffer.write(self.FormatValue(value, self.string_table, self.bom))
+                    buffer.write(self.FormatValue(value, self.string_indices, self.bom))
                 else:
                     nonvalue_nodes.append((value, buffer.tell()))
                     buffer.write(u32(0))
@@ -190,103 +220,120 @@ class Byml:
         
         buffer.align_up(4)
 
+        # Identical subtrees share a node id so they're only written once
         for (data, offset) in nonvalue_nodes:
-            node_data = data
-            data = (self.GetNodeType(data), self.FreezeObj(data))
-            if data in nodes:
-                pos = buffer.tell()
-                buffer.seek(offset)
-                buffer.write(u32(nodes[data], self.bom))
-                buffer.seek(pos)
+            node_id = self.node_ids[id(data)]
+            if node_id in nodes:
+                buffer.patch(offset, u32(nodes[node_id], self.bom))
             else:
-                pos = buffer.tell()
                 address = buffer.tell()
-                buffer.seek(offset)
-                buffer.write(u32(address, self.bom))
-                nodes[data] = address
-                buffer.seek(pos)
-                self.WriteNode(node_data, nodes, buffer)
+                buffer.patch(offset, u32(address, self.bom))
+                nodes[node_id] = address
+                self.WriteNode(data, nodes, buffer)
 
     def WriteStringTable(self, table, buffer):
         start = buffer.tell()
         buffer.write(u8(0xC2))
         buffer.write(u24(len(table), self.bom))
-        offsets = []
-        buffer.skip(4 * len(table) + 4)
-        for entry in table:
-            offsets.append(buffer.tell() - start)
-            buffer.write(entry.encode('utf-8') + b'\x00')
-        end = buffer.tell()
-        offsets.append(end - start)
-        buffer.seek(start + 4)
-        for offset in offsets:
+        encoded = [entry.encode('utf-8') + b'\x00' for entry in table]
+        # Offsets are relative to the start of the node and the last one marks the end of the table
+        offset = 4 * len(table) + 8
+        for entry in encoded:
             buffer.write(u32(offset, self.bom))
-        buffer.seek(end)
+            offset += len(entry)
+        buffer.write(u32(offset, self.bom))
+        buffer.write(b''.join(encoded))
         buffer.align_up(4)
 
     def ParseNode(self):
         node_info = self.GetContainerInfo()
         return self.GetValue(node_info)
 
+    # The node type and the u24 count are read together
     def GetContainerInfo(self):
-        return (self.stream.read_u8(), self.stream.read_u24(self.bom))
+        info = self.stream.read_u32(self.bom)
+        if self.bom == "<":
+            return (info & 0xff, info >> 8)
+        return (info >> 24, info & 0xffffff)
 
+    # Node types are looked up in _parsers instead of going through every type
     def GetValue(self, node_info):
-        if node_info[0] >= 0x20 and node_info[0] <= 0x2f:
-            return self.HashArray(node_info)
-        elif node_info[0] >= 0x30 and node_info[0] <= 0x3f:
-            return self.HashArrayWithRemap(node_info)
-        elif node_info[0] == 0xa0:
-            return self.StringIndex(node_info)
-        elif node_info[0] == 0xa1:
-            return self.BinaryData(node_info)
-        elif node_info[0] == 0xa2:
-            return self.BinaryDataWithAlignment(node_info)
-        elif node_info[0] == 0xc0:
-            return self.Array(node_info)
-        elif node_info[0] == 0xc1:
-            return self.Dictionary(node_info)
-        elif node_info[0] == 0xc2:
-            return self.StringTable(node_info)
-        elif node_info[0] == 0xc4:
-            return self.DictionaryWithRemap(node_info)
-        elif node_info[0] == 0xc5:
-            return self.MonoTypedArray(node_info)
-        elif node_info[0] == 0xd0:
-            return bool(self.stream.read_u32(self.bom))
-        elif node_info[0] == 0xd1:
-            return Int(self.stream.read_s32(self.bom))
-        elif node_info[0] == 0xd2:
-            return Float(self.stream.read_f32(self.bom))
-        elif node_info[0] == 0xd3:
-            return UInt(self.stream.read_u32(self.bom))
-        elif node_info[0] == 0xd4:
-            return Long(self.stream.read_s64(self.bom))
-        elif node_info[0] == 0xd5:
-            return ULong(self.stream.read_u64(self.bom))
-        elif node_info[0] == 0xd6:
-            return Double(self.stream.read_f64(self.bom))
-        elif node_info[0] == 0xff:
-            return
-        else:
+        parser = _parsers[node_info[0]]
+        if parser is None:
             raise ValueError(f"Invalid node type: {hex(node_info[0])}\nFile: {self.filename}\nOffset: {hex(self.stream.tell())}")
-        
+        return parser(self, node_info)
+
     def GetArrayValue(self, node_info):
-        if node_info[0] < 0xa0 or node_info[0] in [0xc0, 0xc1, 0xc4, 0xc8]:
+        if _offset_nodes[node_info[0]]:
             pos = self.stream.tell() + 4
             self.stream.seek(self.stream.read_u32(self.bom))
-            node = self.ParseNode()
-            self.stream.seek(pos)
-            return node
-        elif node_info[0] in [0xa1, 0xa2, 0xd4, 0xd5, 0xd6]:
-            pos = self.stream.tell() + 4
-            self.stream.seek(self.stream.read_u32(self.bom))
-            node = self.GetValue(node_info)
+            if _container_nodes[node_info[0]]:
+                node = self.ParseNode()
+            else:
+                node = self.GetValue(node_info)
             self.stream.seek(pos)
             return node
         else:
             return self.GetValue(node_info)
 
+    # Same as GetArrayValue but takes the 4 bytes stored for the value, which are at pos, after they've already been read
+    # Doesn't restore the stream position
+    def DecodeValue(self, node_type, value, pos):
+        if _offset_nodes[node_type]:
+            self.stream.seek(value)
+            if _container_nodes[node_type]:
+                return self.ParseNode()
+            return self.GetValue((node_type, 1))
+        decoder = _value_decoders[node_type]
+        if decoder is None:
+            self.stream.seek(pos)
+            return self.GetValue((node_type, 1))
+        return decoder(self, value, pos)
+
+    # Reads the values of an array given the type of each one
+    # Arrays of a single scalar type are unpacked all at once, everything else is decoded from the raw values
+    def GetArrayValues(self, types):
+        count = len(types)
+        if count and types.count(types[0]) == count:
+            if types[0] in _bulk_nodes:
+                fmt, cls = _bulk_nodes[types[0]]
+                return list(map(cls, self.stream.read_array(fmt, count, self.bom)))
+            elif types[0] == 0xa0:
+                string_table = self.string_table
+                return [string_table[i] for i in self.stream.read_array("I", count, self.bom)]
+        pos = self.stream.tell()
+        return self.DecodeValues(types, self.stream.read_array("I", count, self.bom), pos, 4)
+
+    # Decodes the raw values of an array or dictionary given their types
+    # The value for each entry is stored at pos + stride * i, common types are handled here instead of going through DecodeValue
+    def DecodeValues(self, types, values, pos, stride):
+        string_table = self.string_table
+        stream = self.stream
+        view = stream.view
+        little = self.bom == "<"
+        unpack_u32, unpack_float = _value_unpackers[self.bom]
+        decoded = []
+        append = decoded.append
+        for offset, node_type, value in zip(range(pos, pos + stride * len(types), stride), types, values):
+            if node_type == 0xa0:
+                append(string_table[value])
+            elif node_type == 0xc1 or node_type == 0xc0:
+                # Same as ParseNode but the container header is read here
+                info = unpack_u32(view, value)[0]
+                stream.seek(value + 4)
+                append(self.GetValue((info & 0xff, info >> 8) if little else (info >> 24, info & 0xffffff)))
+            elif node_type == 0xd2:
+                append(Float(unpack_float(view, offset)[0]))
+            elif node_type == 0xd1:
+                append(Int(value - ((value & 0x80000000) << 1)))
+            elif node_type == 0xd3:
+                append(UInt(value))
+            elif node_type == 0xd0:
+                append(bool(value))
+            else:
+                append(self.DecodeValue(node_type, value, offset))
+        return decoded
+
     def HashArray(self, node_info):
         entry_size = ((node_info[0] & 0xf) + 1) * 0x4 + 0x4
         pos = self.stream.tell()
@@ -322,26 +369,53 @@ class Byml:
         return self.stream.read(size)
 
     def Array(self, node_info):
-        types = []
-        for i in range(node_info[1]):
-            types.append(self.stream.read_u8())
-        while self.stream.tell() % 4 != 0:
-            self.stream.read(1)
-        entries = []
-        for i in range(node_info[1]):
-            entries.append(self.GetArrayValue((types[i], 1)))
-        return entries
-
+        if self.lazy:
+            return LazyArray(self, node_info[1], self.stream.tell())
+        types = self.stream.read_u8_array(node_info[1])
+        self.stream.skip(-self.stream.tell() % 4)
+        return self.GetArrayValues(types)
+
+    # Entries are read all at once as pairs of (u24 name index + u8 node type, value)
+    # and decoded with the same fast paths as DecodeValues, inlined since most dictionaries only have a few entries
     def Dictionary(self, node_info):
+        if self.lazy:
+            return LazyDictionary(self, node_info[1], self.stream.tell())
+        stream = self.stream
+        view = stream.view
+        pos = stream.tell()
+        count = node_info[1]
+        raw = stream.read_array("I", count * 2, self.bom)
+        # The node type is the byte at the end of each entry's first word for either byte order
+        types = view[pos + 3:pos + 8 * count:8].tolist()
+        key_table = self.key_table
+        string_table = self.string_table
+        little = self.bom == "<"
+        unpack_u32, unpack_float = _value_unpackers[self.bom]
         entries = {}
-        for i in range(node_info[1]):
-            name_index = self.stream.read_u24(self.bom)
-            node_type = self.stream.read_u8()
-            entries[self.key_table[name_index]] = self.GetArrayValue((node_type, 1))
+        for offset, node_type, info, value in zip(range(pos + 4, pos + 8 * count, 8), types, raw[0::2], raw[1::2]):
+            key = key_table[info & 0xffffff] if little else key_table[info >> 8]
+            if node_type == 0xa0:
+                entries[key] = string_table[value]
+            elif node_type == 0xc1 or node_type == 0xc0:
+                info = unpack_u32(view, value)[0]
+                stream.seek(value + 4)
+                entries[key] = self.GetValue((info & 0xff, info >> 8) if little else (info >> 24, info & 0xffffff))
+            elif node_type == 0xd2:
+                entries[key] = Float(unpack_float(view, offset)[0])
+            elif node_type == 0xd1:
+                entries[key] = Int(value - ((value & 0x80000000) << 1))
+            elif node_type == 0xd3:
+                entries[key] = UInt(value)
+            elif node_type == 0xd0:
+                entries[key] = bool(value)
+            else:
+                entries[key] = self.DecodeValue(node_type, value, offset)
         return entries
 
     def StringTable(self, node_info):
         base_offsets = self.stream.tell() - 4
+        if self.lazy:
+            return LazyStringTable(self, node_info[1], base_offsets)
         offsets = []
         for i in range(node_info[1]):
             offsets.append(self.stream.read_u32(self.bom))
@@ -362,23 +436,30 @@ class Byml:
     def MonoTypedArray(self, node_info):
         array_type = self.stream.read_u8()
         self.stream.read(3)
-        entries = []
-        for i in range(node_info[1]):
-            entries.append(self.GetArrayValue((array_type, 1)))
-        return entries
+        if self.lazy:
+            return LazyArray(self, node_info[1], self.stream.tell(), array_type)
+        return self.GetArrayValues([array_type] * node_info[1])
     
     # essentially pulled from byml library
+    # Collects the keys and strings into sets and sorts them once
+    # Also builds dicts of each string's index in its table for writing
     def GenerateStringTables(self, data):
-        if type(data) == str and data not in self.string_table:
-            self.string_table.append(data)
-        elif type(data) == list:
-            for item in data:
-                self.GenerateStringTables(item)
-        elif type(data) == dict:
-            for k in data:
-                if k not in self.key_table:
-                    self.key_table.append(k)
-                self.GenerateStringTables(data[k])
+        keys, strings = set(), set()
+        def Collect(data):
+            if type(data) == str:
+                strings.add(data)
+            elif type(data) == list:
+                for item in data:
+                    Collect(item)
+            elif type(data) == dict:
+                keys.update(data)
+                for item in data.values():
+                    Collect(item)
+        Collect(data)
+        self.key_table = sorted(keys)
+        self.string_table = sorted(strings)
+        self.key_indices = {key: i for i, key in enumerate(self.key_table)}
+        self.string_indices = {string: i for i, string in enumerate(self.string_table)}
 
     # from the byml library for now, should probably expand for all node types eventually
     @staticmethod
@@ -415,10 +496,11 @@ class Byml:
             return True
         return False
     
+    # string_indices maps each string to its index in the string table
     @staticmethod
-    def FormatValue(data, string_table, bom):
+    def FormatValue(data, string_indices, bom):
         if isinstance(data, str):
-            return u32(string_table.index(data), bom)
+            return u32(string_indices[data], bom)
         if isinstance(data, bool):
             return u32(1 if data else 0, bom)
         if isinstance(data, Int):
@@ -431,24 +513,406 @@ class Byml:
             return u32(0, bom)
         raise ValueError(f"Invalid value type: {type(data)}")
     
+    # Gives every node an id, structurally identical nodes get the same id
+    # Keys are built bottom up from the ids of a node's children so each subtree is only visited once
+    # Returns a dict of id(node) -> node id, the tree must stay alive while it's in use
     @staticmethod
-    def FreezeObj(o):
-        def Freeze(o):
-            if isinstance(o, dict):
-                return frozenset({k : Freeze(v) for k,v in o.items()}.items())
-            if isinstance(o, list):
-                return tuple([Freeze(i) for i in o])
-            return str(o) + str(type(o))
-        return Freeze(o)
-    
+    def HashNodes(data):
+        node_ids = {}
+        keys = {}
+        def Hash(data):
+            node_id = node_ids.get(id(data))
+            if node_id is not None:
+                return node_id
+            if isinstance(data, dict):
+                # Order doesn't matter since dictionaries are written with sorted keys
+                key = (0xC1, frozenset((k, Hash(v)) for k, v in data.items()))
+            elif isinstance(data, list):
+                key = (0xC0, tuple([Hash(item) for item in data]))
+            elif isinstance(data, float):
+                # repr so 0.0 and -0.0 get different keys while nans share one
+                key = (type(data), repr(data))
+            else:
+                key = (type(data), data)
+            node_id = keys.setdefault(key, len(keys))
+            node_ids[id(data)] = node_id
+            return node_id
+        Hash(data)
+        return node_ids
+
+# Parser for each node type, None for invalid types
+_parsers = [None] * 0x100
+for node_type in range(0x20, 0x30):
+    _parsers[node_type] = Byml.HashArray
+for node_type in range(0x30, 0x40):
+    _parsers[node_type] = Byml.HashArrayWithRemap
+_parsers[0xa0] = Byml.StringIndex
+_parsers[0xa1] = Byml.BinaryData
+_parsers[0xa2] = Byml.BinaryDataWithAlignment
+_parsers[0xc0] = Byml.Array
+_parsers[0xc1] = Byml.Dictionary
+_parsers[0xc2] = Byml.StringTable
+_parsers[0xc4] = Byml.DictionaryWithRemap
+_parsers[0xc5] = Byml.RelocatedStringTable
+_parsers[0xc8] = Byml.MonoTypedArray
+_parsers[0xd0] = lambda byml, node_info: bool(byml.stream.read_u32(byml.bom))
+_parsers[0xd1] = lambda byml, node_info: Int(byml.stream.read_s32(byml.bom))
+_parsers[0xd2] = lambda byml, node_info: Float(byml.stream.read_f32(byml.bom))
+_parsers[0xd3] = lambda byml, node_info: UInt(byml.stream.read_u32(byml.bom))
+_parsers[0xd4] = lambda byml, node_info: Long(byml.stream.read_s64(byml.bom))
+_parsers[0xd5] = lambda byml, node_info: ULong(byml.stream.read_u64(byml.bom))
+_parsers[0xd6] = lambda byml, node_info: Double(byml.stream.read_f64(byml.bom))
+_parsers[0xff] = lambda byml, node_info: byml.stream.skip(4) # Null still takes up a value
+
+# Node types inside arrays and dictionaries that are stored at an offset instead of in place
+_offset_nodes = [node_type < 0xa0 or node_type in [0xa1, 0xa2, 0xc0, 0xc1, 0xc4, 0xc8, 0xd4, 0xd5, 0xd6] for node_type in range(0x100)]
+# Offset nodes that are containers with their own node header
+_container_nodes = [node_type < 0xa0 or node_type in [0xc0, 0xc1, 0xc4, 0xc8] for node_type in range(0x100)]
+# Scalars that can be read in one go when an array only holds that type
+_bulk_nodes = {0xd0: ("I", bool), 0xd1: ("i", Int), 0xd2: ("f", Float), 0xd3: ("I", UInt)}
+
+# Container headers and floats are read straight from the data while decoding values
+_value_unpackers = {end: (struct.Struct(end + "I").unpack_from, struct.Struct(end + "f").unpack_from) for end in "<>"}
+
+# Decoders for values stored in place in arrays and dictionaries, given the value read as a u32 and its offset
+_value_decoders = [None] * 0x100
+_value_decoders[0xa0] = lambda byml, value, pos: byml.string_table[value]
+_value_decoders[0xd0] = lambda byml, value, pos: bool(value)
+_value_decoders[0xd1] = lambda byml, value, pos: Int(value - ((value & 0x80000000) << 1))
+_value_decoders[0xd2] = lambda byml, value, pos: Float(struct.unpack_from(byml.bom + "f", byml.stream.view, pos)[0])
+_value_decoders[0xd3] = lambda byml, value, pos: UInt(value)
+_value_decoders[0xff] = lambda byml, value, pos: None
+
+# Proxies for the containers of a lazy document
+# Each value is read and decoded when it's first accessed and kept after that
+# Nested arrays and dictionaries are proxies too, Materialize() converts a proxy and everything under it to dicts and lists
+# They all share the document's stream so they aren't thread safe
+class LazyDictionary(Mapping):
+    def __init__(self, byml, count, pos):
+        self.byml = byml
+        self.count = count
+        self.pos = pos
+        self.entries = None
+        self._cache = {}
+
+    # Entries are (u24 name index + u8 node type, value), returns (name index, node type, value)
+    def _Entry(self, i):
+        info, value = struct.unpack_from(self.byml.bom + "II", self.byml.stream.view, self.pos + 8 * i)
+        if self.byml.bom == "<":
+            return info & 0xffffff, info >> 24, value
+        return info >> 8, info & 0xff, value
+
+    # Maps each key to the index of its entry, only needed to iterate
+    def _Load(self):
+        if self.entries is None:
+            key_table = self.byml.key_table
+            self.entries = {key_table[self._Entry(i)[0]]: i for i in range(self.count)}
+        return self.entries
+
+    # Entries are sorted by name index and the key table is sorted, so a single key can be found with binary searches
+    # without decoding the other keys
+    def _Find(self, key):
+        if self.entries is not None:
+            return self.entries[key]
+        key_table = self.byml.key_table
+        index = bisect.bisect_left(key_table, key)
+        if index < len(key_table) and key_table[index] == key:
+            i = bisect.bisect_left(range(self.count), index, key=lambda i: self._Entry(i)[0])
+            if i < self.count and self._Entry(i)[0] == index:
+                return i
+        raise KeyError(key)
+
+    # Start and end offsets of the node
+    def _Range(self):
+        return self.pos - 4, self.pos + 8 * self.count
+
+    # Returns the node type of a key's value and the offset of the 4 bytes stored for it
+    def _Slot(self, key):
+        if not(isinstance(key, str)):
+            raise KeyError(key)
+        i = self._Find(key)
+        return self._Entry(i)[1], self.pos + 8 * i + 4
+
+    def __getitem__(self, key):
+        if key not in self._cache:
+            node_type, pos = self._Slot(key)
+            value = struct.unpack_from(self.byml.bom + "I", self.byml.stream.view, pos)[0]
+            self._cache[key] = self.byml.DecodeValue(node_type, value, pos)
+        return self._cache[key]
+
+    def __iter__(self):
+        return iter(self._Load())
+
+    def __len__(self):
+        return self.count
+
+    def __repr__(self):
+        return f"LazyDictionary({self.count} entries)"
+
+class LazyArray(Sequence):
+    # array_type is set for mono typed arrays which don't store a type for each value
+    def __init__(self, byml, count, pos, array_type=None):
+        self.byml = byml
+        self.count = count
+        self.array_type = array_type
+        self.types_pos = pos
+        # Values come after the types, aligned to 4 bytes
+        self.values_pos = pos if array_type is not None else pos + count + (-(pos + count) % 4)
+        self._cache = {}
+
+    # Start and end offsets of the node, mono typed arrays have the array type after the node header
+    def _Range(self):
+        return self.types_pos - (4 if self.array_type is None else 8), self.values_pos + 4 * self.count
+
+    # Returns the node type of a value and the offset of the 4 bytes stored for it
+    def _Slot(self, index):
+        if index < 0:
+            index += self.count
+        if not(0 <= index < self.count):
+            raise IndexError("array index out of range")
+        node_type = self.array_type if self.array_type is not None else self.byml.stream.view[self.types_pos + index]
+        return node_type, self.values_pos + 4 * index
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.count))]
+        if index < 0:
+            index += self.count
+        if index not in self._cache:
+            node_type, pos = self._Slot(index)
+            value = struct.unpack_from(self.byml.bom + "I", self.byml.stream.view, pos)[0]
+            self._cache[index] = self.byml.DecodeValue(node_type, value, pos)
+        return self._cache[index]
+
+    def __len__(self):
+        return self.count
+
+    # Compares equal to lists with the same values like a Mapping does with dicts
+    def __eq__(self, other):
+        if isinstance(other, (list, LazyArray)):
+            return len(self) == len(other) and list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return f"LazyArray({self.count} values)"
+
+class LazyStringTable(Sequence):
+    # Offsets are read along with the string so a lookup doesn't touch the rest of the table
+    def __init__(self, byml, count, base):
+        self.byml = byml
+        self.count = count
+        self.base = base
+        self.strings = {}
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.count))]
+        if index < 0:
+            index += self.count
+        if not(0 <= index < self.count):
+            raise IndexError("string table index out of range")
+        string = self.strings.get(index)
+        if string is None:
+            offset = struct.unpack_from(self.byml.bom + "I", self.byml.stream.view, self.base + 4 * index + 4)[0]
+            string = self.byml.stream.read_string_pool(offset, self.base)
+            self.strings[index] = string
+        return string
+
+    def __len__(self):
+        return self.count
+
+# Converts lazy containers (and any nested in them) to regular dicts and lists
+def Materialize(node):
+    if isinstance(node, Mapping):
+        return {key: Materialize(value) for key, value in node.items()}
+    if isinstance(node, Sequence) and not(isinstance(node, (str, bytes))):
+        return [Materialize(value) for value in node]
+    return node
+
+# Marks a missing path in Query() when no default is given
+_MISSING = object()
+
+# Splits a path into its components, they stay strings since whether one is an array index depends on the node it's used on
+def _SplitPath(path):
+    path = path.strip('/')
+    return path.split('/') if path else []
+
+# Path components that can be used as array indices
+_index_pattern = re.compile(r'-?[0-9]+')
+
+# Follows path components from a node, raises KeyError or IndexError if one doesn't exist
+def _Walk(node, parts):
+    for part in parts:
+        if isinstance(node, Mapping):
+            node = node[part]
+        elif isinstance(node, Sequence) and not(isinstance(node, (str, bytes))) and _index_pattern.fullmatch(part):
+            node = node[int(part)]
+        else:
+            raise KeyError(part)
+    return node
+
+# Looks up a single value by path (e.g. "Data/Bool64bitKey" or "Actors/0/Gyaml") and only decodes what's along the way
+# data is anything Byml() accepts, path components are dictionary keys or array indices separated by /
+# Returns the addressed subtree as regular dicts and lists, or default if the path doesn't exist (KeyError if not given)
+def Query(data, path, default=_MISSING):
+    byml = Byml(data, lazy=True)
+    try:
+        return Materialize(_Walk(byml.root_node, _SplitPath(path)))
+    except (KeyError, IndexError):
+        if default is _MISSING:
+            raise KeyError(path) from None
+        return default
+    finally:
+        if byml.lazy:
+            byml.stream.close()
+
+# Types that plain ints and floats are converted to when patching a value of that node type and how they're stored
+# Only values that are stored exactly are allowed, so floats can't go into integer types and integers have to be in range
+_patch_types = {0xd1: (Int, "i"), 0xd2: (Float, "f"), 0xd3: (UInt, "I"),
+                0xd4: (Long, "q"), 0xd5: (ULong, "Q"), 0xd6: (Double, "d")}
+
+# Checks that a number reads back as the same value once it's stored with the given struct format
+def _IsExact(value, fmt):
+    if type(value) is float and fmt[-1] not in "fd":
+        return False
+    try:
+        stored = struct.unpack(fmt, struct.pack(fmt, value))[0]
+    except (struct.error, OverflowError):
+        return False
+    # NaN never compares equal to itself
+    return stored == value or (stored != stored and value != value)
+
+# Works out the bytes to change for each (path, value) edit without decoding anything that isn't along the paths
+# Returns a list of (offset, bytes) to overwrite and the bytes to append to the end of the file
+# Identical subtrees are usually stored once, so containers along a path are copied to the end of the file and repointed
+# before anything in them is changed (once per reference), otherwise the edit would show up everywhere the container is used
+# 32-bit values (Bool, Int, Float, UInt, and strings already in the string table) are overwritten where they're stored
+# 64-bit values are stored at an offset as well, so the new value is appended and the offset repointed
+def _GetPatches(data, edits):
+    byml = Byml(data, lazy=True)
+    try:
+        if isinstance(edits, Mapping):
+            edits = edits.items()
+        view = byml.stream.view
+        base = len(view) + (-len(view) % 4)
+        writes = []
+        appended = bytearray()
+        # Offset of the (already copied) slot pointing to a copied container -> offset of the copy - offset of the original
+        # Keyed on the slot rather than the path so different spellings of a path (e.g. -1 and 2) share one copy
+        copies = {}
+
+        def Write(offset, value):
+            if offset >= base:
+                appended[offset - base:offset - base + len(value)] = value
+            else:
+                writes.append((offset, value))
+
+        def Append(value):
+            offset = base + len(appended)
+            appended.extend(value)
+            return offset
+
+        for path, value in edits:
+            parts = _SplitPath(path)
+            if not(parts):
+                raise ValueError("The root node can't be patched")
+            node = byml.root_node
+            delta = 0
+            for i, part in enumerate(parts):
+                if not(isinstance(node, (LazyDictionary, LazyArray))):
+                    raise ValueError(f"Only values in arrays and dictionaries can be patched, {path} isn't in one")
+                if isinstance(node, LazyArray):
+                    if not(_index_pattern.fullmatch(part)):
+                        raise KeyError(path)
+                    part = int(part)
+                node_type, slot = node._Slot(part)
+                slot += delta
+                if i == len(parts) - 1:
+                    break
+                child = node[part]
+                if slot not in copies and isinstance(child, (LazyDictionary, LazyArray)):
+                    start, end = child._Range()
+                    offset = Append(view[start:end])
+                    Write(slot, u32(offset, byml.bom))
+                    copies[slot] = offset - start
+                delta = copies.get(slot, 0)
+                node = child
+
+            if node_type not in [0xa0, 0xd0, 0xd1, 0xd2, 0xd3, 0xd4, 0xd5, 0xd6]:
+                raise ValueError(f"Only scalar values can be patched, {path} is {hex(node_type)}")
+            if node_type in _patch_types and type(value) in [int, float, _patch_types[node_type][0]]:
+                cls, fmt = _patch_types[node_type]
+                if not(_IsExact(value, byml.bom + fmt)):
+                    if fmt in "fd":
+                        raise ValueError(f"Node type mismatch at {path}: {value} can't be stored as {cls.__name__} without losing precision")
+                    raise ValueError(f"Node type mismatch at {path}: {value} can't be stored as {cls.__name__}, it's either out of range or not an integer")
+                value = cls(value)
+            if Byml.GetNodeType(value) != node_type:
+                raise ValueError(f"Node type mismatch at {path}: expected {hex(node_type)} but got {hex(Byml.GetNodeType(value))}")
+            match node_type:
+                case 0xa0:
+                    index = bisect.bisect_left(byml.string_table, value)
+                    if index == len(byml.string_table) or byml.string_table[index] != value:
+                        raise ValueError(f"{value} is not in the string table, the file has to be reserialized to add it")
+                    Write(slot, u32(index, byml.bom))
+                case 0xd0 | 0xd1 | 0xd2 | 0xd3:
+                    Write(slot, Byml.FormatValue(value, None, byml.bom))
+                case 0xd4 | 0xd5 | 0xd6:
+                    Write(slot, u32(Append({0xd4: s64, 0xd5: u64, 0xd6: f64}[node_type](value, byml.bom)), byml.bom))
+        if appended:
+            appended[0:0] = bytes(base - len(view))
+        return writes, bytes(appended)
+    finally:
+        byml.stream.close()
+
+# Changes scalar values in a binary BYML file without reserializing it, edits are (path, new value) pairs or a dict
+# Values must be the same type as what they replace (plain ints and floats are converted), strings must already be in the file
+# Returns the patched data as a new bytearray, nothing off the edited paths is read or re-encoded
+# The file grows by the containers copied along the paths, reserializing it drops the unused originals
+def Patch(data, edits):
+    writes, appended = _GetPatches(data, edits)
+    data = bytearray(data)
+    for offset, value in writes:
+        data[offset:offset + len(value)] = value
+    data += appended
+    return data
+
+# Same as Patch() but the file is modified in place
+def PatchFile(filepath, edits):
+    data = map_file(filepath)
+    try:
+        writes, appended = _GetPatches(data, edits)
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+    with open(filepath, 'r+b') as file:
+        for offset, value in writes:
+            file.seek(offset)
+            file.write(value)
+        if appended:
+            file.seek(0, os.SEEK_END)
+            file.write(appended)
+
 def ExtractPtcl(path_to_esetb):
     filepath = path_to_esetb
     files = os.listdir(filepath)
     if not(os.path.exists('ptcl')):
         os.makedirs('ptcl')
-    for file in files:
+    # Files are read, parsed, and written in overlapping stages
+    def read(file):
         print(file)
-        byml = Byml(os.path.join(filepath, file))
-        if 'PtclBin' in byml.root_node:
-            with open('ptcl/' + os.path.splitext(byml.filename)[0] + '.ptcl', 'wb') as f:
-                f.write(byml.root_node['PtclBin'])
\ No newline at end of file
+        with open(os.path.join(filepath, file), 'rb') as f:
+            return file, f.read()
+    # Only the PtclBin node is decoded
+    def parse(item):
+        file, data = item
+        ptcl = Query(data, 'PtclBin', None)
+        if ptcl is not None:
+            return os.path.splitext(file)[0], ptcl
+    def write(item):
+        name, ptcl = item
+        with open('ptcl/' + name + '.ptcl', 'wb') as f:
+            f.write(ptcl)
+        return name
+    workers = pipeline.DefaultWorkers()
+    pipeline.Pipeline().AddStage(read, workers).AddStage(parse).AddStage(write, workers).Run(files)
\ No newline at end of file
@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import shutil
+import sqlite3
+import atexit
+import threading
+from hashlib import sha1
+
+class Cache:
+    # Persistent cache of decompressed files and values derived from them (decompressed size, SARC file lists, etc.)
+    # Entries are keyed by the source file's path, size, and modification time so a modified file is never served stale
+    # Payloads are stored as files and indexed in a sqlite database that tracks their size and last use
+    # Least recently used entries are evicted once the cache grows past max_size bytes
+    def __init__(self, cache_dir, max_size=4 * 1024 ** 3):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size = max_size
+        os.makedirs(os.path.join(self.cache_dir, "data"), exist_ok=True)
+        # sqlite connections can't be shared between threads
+        self._local = threading.local()
+        self._size = None
+        # Pending last use times, shared by all threads so any of them can flush them
+        self._touched = {}
+        self._touched_lock = threading.Lock()
+        db = self._Connect()
+        db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT NOT NULL, name TEXT NOT NULL, size INTEGER NOT NULL, "
+                   "last_used REAL NOT NULL, value TEXT, PRIMARY KEY (key, name))")
+        db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        db.commit()
+        atexit.register(self.Flush)
+
+    # The arguments needed to open the same cache in another process
+    def __reduce__(self):
+        return (Cache, (self.cache_dir, self.max_size))
+
+    def _Connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(os.path.join(self.cache_dir, "index.db"), timeout=60)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    # Returns None if the file doesn't exist
+    @staticmethod
+    def Key(filepath):
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return None
+        return sha1(f"{os.path.abspath(filepath)}\0{stat.st_size}\0{stat.st_mtime_ns}".encode()).hexdigest()
+
+    def _DataPath(self, key):
+        return os.path.join(self.cache_dir, "data", key[:2], key)
+
+    # Last use times are only written out every so often since committing on every read is slow
+    def _Touch(self, key, name):
+        with self._touched_lock:
+            self._touched[(key, name)] = time.time()
+            count = len(self._touched)
+        if count >= 256:
+            self.Flush()
+
+    # Writes out pending last use times from every thread
+    def Flush(self):
+        with self._touched_lock:
+            touched, self._touched = self._touched, {}
+        if touched:
+            db = self._Connect()
+            db.executemany("UPDATE entries SET last_used = ? WHERE key = ? AND name = ?",
+                           [(last_used, key, name) for (key, name), last_used in touched.items()])
+            db.commit()
+
+    def _Add(self, key, name, size, value=None):
+        db = self._Connect()
+        old = db.execute("SELECT size FROM entries WHERE key = ? AND name = ?", (key, name)).fetchone()
+        db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)", (key, name, size, time.time(), value))
+        db.commit()
+        if self._size is None:
+            self._size = self.GetSize()
+        else:
+            self._size += size - (old[0] if old else 0)
+        if self._size > self.max_size:
+            self.Evict()
+
+    # Path to the cached decompressed data of a file, None if it isn't cached
+    def GetDataPath(self, filepath):
+        key = self.Key(filepath)
+        if key is None:
+            return None
+        if self._Connect().execute("SELECT 1 FROM entries WHERE key = ? AND name = 'data'", (key,)).fetchone() is None:
+            return None
+        path = self._DataPath(key)
+        if not(os.path.exists(path)):
+            return None
+        self._Touch(key, "data")
+        return path
+
+    # Cached decompressed data of a file, None if it isn't cached
+    def GetData(self, filepath):
+        path = self.GetDataPath(filepath)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as file:
+                return file.read()
+        except OSError: # Evicted by another process
+            return None
+
+    def PutData(self, filepath, data):
+        self._PutData(filepath, lambda file: file.write(data), len(data))
+
+    # Same as PutData but the data is copied from another file
+    def PutDataFromFile(self, filepath, data_path):
+        with open(data_path, 'rb') as source:
+            self._PutData(filepath, lambda file: shutil.copyfileobj(source, file), os.path.getsize(data_path))
+
+    def _PutData(self, filepath, write, size):
+        key = self.Key(filepath)
+        if key is None or size > self.max_size:
+            return
+        path = self._DataPath(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written to a temporary file first so other processes never see a partial file
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as file:
+            write(file)
+        os.replace(temp_path, path)
+        self._Add(key, "data", size)
+
+    # Cached value derived from a file, default if it isn't cached
+    def GetValue(self, filepath, name, default=None):
+        key = self.Key(filepath)
+        if key is None:
+            return default
+        db = self._Connect()
+        row = db.execute("SELECT value FROM entries WHERE key = ? AND name = ?", (key, name)).fetchone()
+        if row is None:
+            return default
+        self._Touch(key, name)
+        return json.loads(row[0])
+
+    # Values are stored as JSON
+    def PutValue(self, filepath, name, value):
+        key = self.Key(filepath)
+        if key is None:
+            return
+        value = json.dumps(value)
+        self._Add(key, name, len(value), value)
+
+    # Total size of all cached entries
+    def GetSize(self):
+        return self._Connect().execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    # Removes the least recently used entries until the cache fits in max_size
+    # By default it goes down to 90% of the cache's max_size so the next few puts don't have to evict again
+    def Evict(self, max_size=None):
+        if max_size is None:
+            max_size = int(self.max_size * 0.9)
+        self.Flush()
+        db = self._Connect()
+        size = self.GetSize()
+        # Candidates are fetched a page at a time instead of reading the whole table
+        while size > max_size:
+            rows = db.execute("SELECT key, name, size FROM entries ORDER BY last_used LIMIT 256").fetchall()
+            if not(rows):
+                break
+            removed = []
+            for key, name, entry_size in rows:
+                if size <= max_size:
+                    break
+                removed.append((key, name))
+                size -= entry_size
+            db.executemany("DELETE FROM entries WHERE key = ? AND name = ?", removed)
+            db.commit()
+            for key, name in removed:
+                if name == "data":
+                    try:
+                        os.remove(self._DataPath(key))
+                    except OSError:
+                        pass
+        self._size = size
+
+    def Clear(self):
+        self.Evict(0)
+
+    def Close(self):
+        self.Flush()
+        db = getattr(self._local, "db", None)
+        if db is not None:
+            db.close()
+            self._local.db = None
@@ -7,8 +7,7 @@ import re
 class Msbt:
     def __init__(self, filepath):
         self.filename = os.path.basename(filepath)
-        with open(filepath, 'rb') as f:
-            self.stream = ReadStream(f.read())
+        self.stream = ReadStream(map_file(filepath), owns_data=True)
 
         self.magic = self.stream.read(8).decode('utf-8')
         assert self.magic == "MsgStdBn", f"Invalid file magic, expected 'MsgStdBn' but got '{self.magic}'"
@@ -62,6 +61,7 @@ class Msbt:
             message[self.labels[i]] = text
             self.messages[index] = message
         self.messages = list(dict(sorted(self.messages.items())).values())
+        self.stream.close()
 
         self.output_dict = {
             "ByteOrder" : self.byte_order,
@@ -0,0 +1,87 @@
+import asyncio
+import os
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+# Marks the end of the items passed between stages
+_DONE = object()
+
+class Pipeline:
+    # Runs items through a series of stages (e.g. read -> decompress -> parse -> write) so that the stages overlap
+    # Each stage function takes an item and returns the item for the next stage, or None to drop it
+    # Stage functions run in an executor so blocking I/O and zstd (which releases the GIL) don't hold up the other stages
+    # Stages are connected by queues holding at most queue_size items so a slow stage limits how much is held in memory
+    def __init__(self, queue_size=16, executor=None):
+        self.queue_size = queue_size
+        self.executor = executor
+        self.stages = []
+
+    # workers is the number of items the stage can work on at once
+    # If when is set, items it returns False for skip this stage, it's called directly so it should be cheap
+    def AddStage(self, function, workers=1, when=None):
+        self.stages.append((function, workers, when))
+        return self
+
+    # Runs every item from the iterable through the stages, items are pulled from it as the first stage has room
+    # Returns the output of the last stage in the order the items finished
+    def Run(self, items):
+        executor = self.executor
+        if executor is None:
+            executor = ThreadPoolExecutor(sum(workers for function, workers, when in self.stages) + 1)
+        try:
+            return asyncio.run(self._Run(items, executor))
+        finally:
+            if self.executor is None:
+                executor.shutdown()
+
+    async def _Run(self, items, executor):
+        loop = asyncio.get_running_loop()
+        queues = [asyncio.Queue(self.queue_size) for i in range(len(self.stages))]
+        results = []
+
+        async def feed():
+            iterator = iter(items)
+            while True:
+                # The iterable may do I/O (e.g. os.walk) so it's advanced in the executor as well
+                batch = await loop.run_in_executor(executor, list, itertools.islice(iterator, self.queue_size))
+                if not(batch):
+                    break
+                for item in batch:
+                    await queues[0].put(item)
+            await queues[0].put(_DONE)
+
+        async def work(index, function, when, finished):
+            queue = queues[index]
+            while True:
+                item = await queue.get()
+                if item is _DONE:
+                    # Passed on so the other workers of this stage see it too
+                    await queue.put(_DONE)
+                    break
+                if when is None or when(item):
+                    item = await loop.run_in_executor(executor, function, item)
+                    if item is None:
+                        continue
+                if index + 1 < len(queues):
+                    await queues[index + 1].put(item)
+                else:
+                    results.append(item)
+            finished[index] -= 1
+            if finished[index] == 0 and index + 1 < len(queues):
+                await queues[index + 1].put(_DONE)
+
+        finished = [workers for function, workers, when in self.stages]
+        tasks = [asyncio.ensure_future(feed())]
+        for index, (function, workers, when) in enumerate(self.stages):
+            tasks += [asyncio.ensure_future(work(index, function, when, finished)) for i in range(workers)]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        return results
+
+# Worker count for stages that are mostly waiting on zstd or the disk
+def DefaultWorkers():
+    return min(os.cpu_count() or 1, 8)
@@ -6,6 +6,7 @@ try:
 except ImportError:
     raise ImportError("Would you be so kind as to LEARN TO FUCKING READ INSTRUCTIONS")
 import sarc
+import pipeline
 import os
 import binascii
 import json
@@ -31,10 +32,9 @@ class Restbl:
                 data = decompressor.decompress(compressed)
                 filepath = os.path.splitext(filepath)[0]
         else:
-            with open(filepath, 'rb') as f:
-                data = f.read()
+            data = map_file(filepath)
         
-        self.stream = ReadStream(data)
+        self.stream = ReadStream(data, owns_data=True)
         self.filename = os.path.basename(filepath)
         self.game_version = os.path.splitext(os.path.splitext(filepath)[0])[1][1:]
         self.hashmap = {}
@@ -55,6 +55,7 @@ class Restbl:
         
         for i in range(self.collision_count):
             self.ReadCollisionEntry()
+        self.stream.close()
     
     def ReadHashEntry(self):
         hash = self.stream.read_u32()
@@ -70,28 +71,37 @@ class Restbl:
         return
 
     def Reserialize(self, output_dir=''):
-        if os.path.exists(output_dir):
+        if output_dir and not(os.path.exists(output_dir)):
             os.makedirs(output_dir)
         with open(os.path.join(output_dir, self.filename), 'wb') as outfile:
-            self.buffer = WriteStream(outfile)
-            self.buffer.write("RESTBL".encode('utf-8'))
-            self.buffer.write(u32(self.version))
-            self.buffer.write(u32(self.string_size))
-            self.buffer.write(u32(len(self.hash_table)))
-            self.buffer.write(u32(len(self.collision_table)))
-            # Hash table is sorted by hash for fast lookup
-            self.hash_table = dict(sorted(self.hash_table.items()))
-            # Collision table is sorted by name for fast lookup
-            self.collision_table = dict(sorted(self.collision_table.items()))
-            for hash in self.hash_table:
-                self.buffer.write(u32(hash))
-                self.buffer.write(u32(self.hash_table[hash]))
-            for name in self.collision_table:
-                string = name.encode('utf-8')
-                while len(string) != self.string_size:
-                    string += b'\x00'
-                self.buffer.write(string)
-                self.buffer.write(u32(self.collision_table[name]))
+            outfile.write(self.ToBytes())
+
+    # Serializes the table in memory and returns the file as bytes
+    def ToBytes(self):
+        self.buffer = WriteStream()
+        self.buffer.write("RESTBL".encode('utf-8'))
+        self.buffer.write(u32(self.version))
+        self.buffer.write(u32(self.string_size))
+        self.buffer.write(u32(len(self.hash_table)))
+        self.buffer.write(u32(len(self.collision_table)))
+        # Hash table is sorted by hash for fast lookup
+        self.hash_table = dict(sorted(self.hash_table.items()))
+        # Collision table is sorted by name for fast lookup
+        self.collision_table = dict(sorted(self.collision_table.items()))
+        for hash in self.hash_table:
+            self.buffer.write(u32(hash))
+            self.buffer.write(u32(self.hash_table[hash]))
+        for name in self.collision_table:
+            self.buffer.write(name.encode('utf-8').ljust(self.string_size, b'\x00'))
+            self.buffer.write(u32(self.collision_table[name]))
+        return self.buffer.getvalue()
+
+    # Serializes the table and writes it zstd-compressed without an intermediate uncompressed file
+    def ReserializeCompressed(self, output_dir=''):
+        if output_dir and not(os.path.exists(output_dir)):
+            os.makedirs(output_dir)
+        with open(os.path.join(output_dir, self.filename + '.zs'), 'wb') as outfile:
+            outfile.write(zs.ZstdCompressor().compress(self.ToBytes()))
 
     def AddEntry(self, path, size):
         hash = binascii.crc32(path.encode('utf-8'))
@@ -401,12 +411,8 @@ class Restbl:
         self.hash_table = data["Hash Table"]
         self.collision_table = data["Collision Table"]
 
-# List of all files in a directory
-def GetStringList(romfs_path, dump_path=''):
-    paths = []
-    if dump_path == '':
-        dump_path = romfs_path
-    zs = zstd.Zstd(dump_path)
+# Files in a romfs that have RESTBL entries as (path, full path)
+def WalkRomfs(romfs_path):
     for dir,subdir,files in os.walk(romfs_path):
         for file in files:
             full_path = os.path.join(dir, file)
@@ -416,16 +422,64 @@ def GetStringList(romfs_path, dump_path=''):
                 if os.path.splitext(filepath)[1] in ['.zs', '.zstd', '.mc']:
                     filepath = os.path.splitext(filepath)[0]
                 if os.path.splitext(filepath)[1] not in ['.bwav', '.rsizetable', '.rcl'] and os.path.splitext(filepath)[0] != r"Pack\ZsDic":
-                    filepath = filepath.replace('\\', '/')
-                    paths.append(filepath)
-                    print(filepath)
-                    if os.path.splitext(filepath)[1] == '.pack':
-                        archive = sarc.Sarc(zs.Decompress(full_path, no_output=True))
-                        paths += archive.ListFiles()
+                    yield filepath.replace('\\', '/'), full_path
+
+# Runs over every file from WalkRomfs with overlapping read -> decompress -> parse stages
+# read_file(path, full path) is called for each file and read_pack(archive) for the contents of each pack
+# Packs are skipped if read_file returns None and include_pack is set
+# read_pack's results are stored in the zstd cache under cache_name when it's enabled
+# Returns (path, read_file result, read_pack result or None) for each file in the order they finished
+def ScanRomfs(romfs_path, zs, read_pack, cache_name, read_file=None, include_pack=False):
+    def read(item):
+        filepath, full_path, value, data, contents = item
+        if read_file is not None:
+            value = read_file(filepath, full_path)
+        if os.path.splitext(filepath)[1] != '.pack' or (include_pack and value is None):
+            return filepath, full_path, value, None, None
+        if zs.cache is not None:
+            contents = zs.cache.GetValue(full_path, cache_name)
+            if contents is not None:
+                return filepath, full_path, value, None, contents
+        with open(full_path, 'rb') as f:
+            return filepath, full_path, value, f.read(), None
+
+    def decompress(item):
+        filepath, full_path, value, data, contents = item
+        return filepath, full_path, value, zs.DecompressData(data, full_path), contents
+
+    def parse(item):
+        filepath, full_path, value, data, contents = item
+        contents = read_pack(sarc.Sarc(data))
+        if zs.cache is not None:
+            zs.cache.PutValue(full_path, cache_name, contents)
+        return filepath, full_path, value, None, contents
+
+    workers = pipeline.DefaultWorkers()
+    scan = pipeline.Pipeline()
+    scan.AddStage(read, workers, lambda item: read_file is not None or os.path.splitext(item[0])[1] == '.pack')
+    scan.AddStage(decompress, workers, lambda item: item[3] is not None and os.path.splitext(item[1])[1] in ['.zs', '.zstd'])
+    scan.AddStage(parse, 1, lambda item: item[3] is not None)
+    return [(filepath, value, contents) for filepath, full_path, value, data, contents in scan.Run((filepath, full_path, None, None, None) for filepath, full_path in WalkRomfs(romfs_path))]
+
+# List of all files in a directory
+def GetStringList(romfs_path, dump_path=''):
+    paths = []
+    if dump_path == '':
+        dump_path = romfs_path
+    zs = zstd.Zstd(dump_path)
+    for filepath, value, files in ScanRomfs(romfs_path, zs, lambda archive: archive.ListFiles(), "pack_files"):
+        paths.append(filepath)
+        print(filepath)
+        if files is not None:
+            paths += files
     paths = list(set(paths))
     paths.sort()
     return paths
 
+# Name, estimated size, and SHA-256 hash of each file in a pack
+def GetPackInfo(archive, dump_path):
+    return [[f["Name"], CalcSize(f["Name"], dump_path, f["Data"]), sha256(f["Data"]).hexdigest()] for f in archive.files]
+
 # List of list of files for each mod in a directory
 def GetFileLists(mod_path, dump_path=''):
     if dump_path == '':
@@ -443,26 +497,16 @@ def GetInfo(romfs_path, dump_path=''):
     if dump_path == '':
         dump_path = romfs_path
     zs = zstd.Zstd(dump_path)
-    for dir,subdir,files in os.walk(romfs_path):
-        for file in files:
-            full_path = os.path.join(dir, file)
-            filepath = full_path
-            if os.path.isfile(filepath):
-                filepath = os.path.join(os.path.relpath(dir, romfs_path), os.path.basename(filepath))
-                if os.path.splitext(filepath)[1] in ['.zs', '.zstd', '.mc']:
-                    filepath = os.path.splitext(filepath)[0]
-                if os.path.splitext(filepath)[1] not in ['.bwav', '.rsizetable', '.rcl'] and os.path.splitext(filepath)[0] != r"Pack\ZsDic":
-                    filepath = filepath.replace('\\', '/')
-                    info[filepath] = CalcSize(full_path, dump_path)
-                    print(filepath)
-                    if os.path.splitext(filepath)[1] == '.pack':
-                        archive = sarc.Sarc(zs.Decompress(full_path, no_output=True))
-                        for f in archive.files:
-                            size = CalcSize(f["Name"], dump_path, f["Data"])
-                            if f["Name"] not in info:
-                                info[f["Name"]] = size
-                            else:
-                                info[f["Name"]] = max(info[f["Name"]], size)
+    for filepath, size, files in ScanRomfs(romfs_path, zs, lambda archive: GetPackInfo(archive, dump_path), "pack_info",
+                                           lambda filepath, full_path: CalcSize(full_path, dump_path)):
+        info[filepath] = size
+        print(filepath)
+        if files is not None:
+            for name, size, cs in files:
+                if name not in info:
+                    info[name] = size
+                else:
+                    info[name] = max(info[name], size)
     info = dict(sorted(info.items()))
     return info
 
@@ -474,43 +518,36 @@ def GetInfoWithChecksum(romfs_path, dump_path='', version=121):
     zs = zstd.Zstd(dump_path)
     with open(get_correct_path('checksums/TearsOfTheKingdom' + str(version).replace('.', '') + '.json'), 'r') as f:
         checksums = json.load(f)
-    for dir,subdir,files in os.walk(romfs_path):
-        for file in files:
-            full_path = os.path.join(dir, file)
-            filepath = full_path
-            checksum = CalcFileChecksum(full_path)
-            if os.path.isfile(filepath):
-                filepath = os.path.join(os.path.relpath(dir, romfs_path), os.path.basename(filepath))
-                if os.path.splitext(filepath)[1] in ['.zs', '.zstd', '.mc']:
-                    filepath = os.path.splitext(filepath)[0]
-                if os.path.splitext(filepath)[1] not in ['.bwav', '.rsizetable', '.rcl'] and os.path.splitext(filepath)[0] != r"Pack\ZsDic":
-                    filepath = filepath.replace('\\', '/')
-                    add = False
-                    if filepath in checksums:
-                        if checksum != checksums[filepath]:
-                            add = True
-                    else:
+    # Size of the file if it's been modified, otherwise None
+    def read_file(filepath, full_path):
+        checksum = CalcFileChecksum(full_path)
+        add = False
+        if filepath in checksums:
+            if checksum != checksums[filepath]:
+                add = True
+        else:
+            add = True
+        if add:
+            return CalcSize(full_path, dump_path)
+    for filepath, size, files in ScanRomfs(romfs_path, zs, lambda archive: GetPackInfo(archive, dump_path), "pack_info",
+                                           read_file, True):
+        if size is None:
+            continue
+        info[filepath] = size
+        print(filepath)
+        if files is not None:
+            for name, size, cs in files:
+                add = False
+                if name in checksums:
+                    if cs != checksums[name]:
                         add = True
-                    if add:
-                        info[filepath] = CalcSize(full_path, dump_path)
-                        print(filepath)
-                        if os.path.splitext(filepath)[1] == '.pack':
-                            archive = sarc.Sarc(zs.Decompress(full_path, no_output=True))
-                            archive_info = archive.files
-                            for f in archive_info:
-                                cs = sha256(f["Data"]).hexdigest()
-                                add = False
-                                if f["Name"] in checksums:
-                                    if cs != checksums[f["Name"]]:
-                                        add = True
-                                else:
-                                    add = True
-                                if add:
-                                    size = CalcSize(f["Name"], dump_path, len(f["Data"]))
-                                    if f["Name"] not in info:
-                                        info[f["Name"]] = size
-                                    else:
-                                        info[f["Name"]] = max(info[f["Name"]], size)
+                else:
+                    add = True
+                if add:
+                    if name not in info:
+                        info[name] = size
+                    else:
+                        info[name] = max(info[name], size)
     info = dict(sorted(info.items()))
     return info
 
@@ -536,10 +573,9 @@ def CalcSize(file, romfs_path, data=None):
         with open(file, 'rb') as f:
             data = f.read()
     size = len(data)
-    decompressor = zstd.Zstd(romfs_path)
     path, ext = os.path.splitext(file)
     if ext in ['.zs', '.zstd'] and '.ta.zs' not in file:
-        size = decompressor.GetDecompressedSize(file)
+        size = zstd.Zstd(romfs_path).GetDecompressedSize(file)
         file = path
         ext = os.path.splitext(file)[1]
     elif ext == '.mc':
@@ -681,16 +717,10 @@ def MergeMods(mod_path, romfs_path, restbl_path='', version=121, compressed=True
         json.dump(changelog, f, indent=4)
     print("Applying changes...")
     restbl.ApplyChangelog(changelog)
-    restbl.Reserialize()
     if compressed:
-        with open(restbl.filename, 'rb') as file:
-            data = file.read()
-        if os.path.exists(restbl.filename + '.zs'):
-            os.remove(restbl.filename + '.zs')
-        os.rename(restbl.filename, restbl.filename + '.zs')
-        with open(restbl.filename + '.zs', 'wb') as file:
-            compressor = zs.ZstdCompressor()
-            file.write(compressor.compress(data))
+        restbl.ReserializeCompressed()
+    else:
+        restbl.Reserialize()
     print("Finished")
 
 # Simple GUI, nothing special
@@ -716,16 +746,10 @@ def open_tool():
             changelog = MergeChangelogs([changelog0, changelog1])
             print("Applying changes...")
             restbl.ApplyChangelog(changelog)
-            restbl.Reserialize()
             if values['compressed']:
-                with open(restbl.filename, 'rb') as file:
-                    data = file.read()
-                if os.path.exists(restbl.filename + '.zs'):
-                    os.remove(restbl.filename + '.zs')
-                os.rename(restbl.filename, restbl.filename + '.zs')
-                with open(restbl.filename + '.zs', 'wb') as file:
-                    compressor = zs.ZstdCompressor()
-                    file.write(compressor.compress(data))
+                restbl.ReserializeCompressed()
+            else:
+                restbl.Reserialize()
             print("Finished")
         case 'Generate Changelog':
             gen_changelog()
@@ -803,16 +827,10 @@ def apply_patches(compressed=True):
     changelog = MergeChangelogs(changelogs)
     print("Applying patches...")
     restbl.ApplyChangelog(changelog)
-    restbl.Reserialize()
     if compressed:
-        with open(restbl.filename, 'rb') as file:
-            data = file.read()
-        if os.path.exists(restbl.filename + '.zs'):
-            os.remove(restbl.filename + '.zs')
-        os.rename(restbl.filename, restbl.filename + '.zs')
-        with open(restbl.filename + '.zs', 'wb') as file:
-            compressor = zs.ZstdCompressor()
-            file.write(compressor.compress(data))
+        restbl.ReserializeCompressed()
+    else:
+        restbl.Reserialize()
     print("Finished")
 
 if __name__ == "__main__":
@@ -1,41 +1,151 @@
 from utils import *
 import os
-import io
+import bisect
+import shutil
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+
+class LazyEntry(MutableMapping):
+    # Archive entry that behaves like a {"Name": ..., "Data": ...} dict but loads some of its values on first access
+    # Subclasses list the keys they load in _lazy_keys and load them in _Load
+    __slots__ = ["_values", "_lazy_keys"]
+
+    def __init__(self, lazy_keys):
+        self._values = {}
+        self._lazy_keys = list(lazy_keys)
+
+    def _Load(self, key):
+        raise KeyError(key)
+
+    # Whether a value has been loaded (or set) yet
+    def IsLoaded(self, key):
+        return key in self._values
+
+    def __getitem__(self, key):
+        if key not in self._values:
+            if key not in self._lazy_keys:
+                raise KeyError(key)
+            self._values[key] = self._Load(key)
+        return self._values[key]
+
+    def __setitem__(self, key, value):
+        self._values[key] = value
+
+    def __delitem__(self, key):
+        if key in self._lazy_keys:
+            self._lazy_keys.remove(key)
+            self._values.pop(key, None)
+        else:
+            del self._values[key]
+
+    # Name and Data come first like in the entries of a fully loaded archive
+    def _Keys(self):
+        keys = dict.fromkeys(key for key in ["Name", "Data"] if key in self._values or key in self._lazy_keys)
+        keys.update(dict.fromkeys(self._values))
+        keys.update(dict.fromkeys(self._lazy_keys))
+        return list(keys)
+
+    def __iter__(self):
+        return iter(self._Keys())
+
+    def __len__(self):
+        return len(self._Keys())
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.get('Name')!r})"
+
+class SarcFile(LazyEntry):
+    # Archive entry that only decodes its name and slices its data when they're first accessed
+    # "Data" is a memoryview into the archive, use bytes() on it to get a copy
+    __slots__ = ["archive", "name_offset", "start", "end"]
+
+    def __init__(self, archive, name_offset, start, end):
+        super().__init__(["Name", "Data"])
+        self.archive = archive
+        self.name_offset = name_offset
+        self.start = start
+        self.end = end
+
+    def _Load(self, key):
+        if key == "Name":
+            return self.archive.stream.read_string_pool(self.name_offset, self.archive.name_table_offset)
+        return self.archive.data[self.start:self.end]
+
+class SourceFile(LazyEntry):
+    # Entry whose data lives outside the archive (a filepath, a callable returning the data, or a bytes-like object)
+    # "Data" is only loaded when accessed, writers stream the source into the output instead
+    __slots__ = ["source", "size"]
+
+    def __init__(self, name, source, size=None):
+        super().__init__(["Data"])
+        self["Name"] = name
+        self.source = source
+        self.size = size
+
+    def _Load(self, key):
+        if isinstance(self.source, (str, os.PathLike)):
+            with open(self.source, 'rb') as file:
+                return file.read()
+        elif callable(self.source):
+            return self.source()
+        return self.source
+
+    # Size of the data without loading it
+    def GetSize(self):
+        if self.IsLoaded("Data"):
+            return len(self["Data"])
+        if self.size is None:
+            if isinstance(self.source, (str, os.PathLike)):
+                self.size = os.path.getsize(self.source)
+            elif callable(self.source):
+                raise ValueError(f"Size must be provided for callable sources: {self['Name']}")
+            else:
+                self.size = len(self.source)
+        return self.size
+
+# Write target that hashes everything written to it
+class DigestWriter:
+    def __init__(self):
+        self.hash = sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.hash.update(data)
+        self.size += len(data)
+
+    def tell(self):
+        return self.size
+
+    def digest(self):
+        return self.hash.digest()
 
 class Sarc:
     # Takes a SARC file, directory, or raw bytes as input
     # If using raw bytes, please provide a filename
-    def __init__(self, data, filename=''):
-        if type(data) != bytes:
+    # With lazy=True, the archive stays mapped and file names/data are only read when accessed
+    def __init__(self, data, filename='', lazy=False):
+        owns_data = False
+        self.source_path = None # Set if the archive was mapped from a file
+        if isinstance(data, (str, os.PathLike)):
             self.filename = os.path.basename(data)
             # Convert directory into Sarc object
             if os.path.isdir(data):
-                self.magic = "SARC"
-                self.header_size = 0x14
-                self.bom = None
-                self.version = 0x100
-                self.sfat_magic = "SFAT"
-                self.sfat_header_size = 0x0c
-                self.hash_mult = 101
-                self.sfnt_magic = "SFNT"
-                self.sfnt_header_size = 0x08
-                self.files = []
+                self._InitEmpty()
+                # File data is streamed from disk when the archive is written
                 for root_dir, dir, files in os.walk(data):
                     for file in files:
-                        file_data = {}
                         dir_path = os.path.relpath(root_dir, data)
                         file_path = os.path.join(dir_path, file)
-                        file_data["Name"] = file_path
-                        with open(os.path.join(data, file_path), 'rb') as f:
-                            file_data["Data"] = f.read()
-                        self.files.append(file_data)
+                        self.files.append(SourceFile(file_path, os.path.join(data, file_path)))
                 return
             elif os.path.isfile(data):
-                with open(data, 'rb') as file:
-                    data = file.read()
+                self.source_path = os.path.abspath(data)
+                data = map_file(data)
+                owns_data = True
         else:
             self.filename = filename
-        self.stream = ReadStream(data)
+        self.stream = ReadStream(data, owns_data)
 
         # File header
         self.magic = self.stream.read(4).decode('utf-8')
@@ -53,8 +163,6 @@ class Sarc:
         assert self.version == 0x100, f"Invalid version, expected 0x100 but got {hex(self.version)}"
         self.stream.read(2)
 
-        self.stream.seek(self.data_offset)
-        self.data = self.stream.read()
         self.stream.seek(self.header_size)
 
         # SFAT Header
@@ -68,16 +176,8 @@ class Sarc:
         self.hash_mult = self.stream.read_u32(self.bom)
         assert self.hash_mult == 101, f"Hash multiplier in official files must be 101, got {self.hash_mult}"
 
-        nodes = []
-        for i in range(self.file_count):
-            node = {}
-            node["Hash"] = self.stream.read_u32(self.bom)
-            name_and_flags = self.stream.read_u32(self.bom)
-            node["Collision Flag"] = name_and_flags >> 24
-            node["Filename Offset"] = (name_and_flags & 0xffffff) * 4 # Offset is divided by 4
-            node["Data Start"] = self.stream.read_u32(self.bom)
-            node["Data End"] = self.stream.read_u32(self.bom)
-            nodes.append(node)
+        # (Hash, Collision Flag << 24 | Filename Offset / 4, Data Start, Data End)
+        nodes = self.stream.read_struct_array("IIII", self.file_count, self.bom)
         
         if self.data_offset < self.stream.tell():
             raise ValueError("Data section must come after SFNT section")
@@ -90,121 +190,302 @@ class Sarc:
         self.stream.read(2)
 
         self.name_table_offset = self.stream.tell()
+        self.size = self.stream.size
+
+        # SFAT nodes are sorted by hash so single files can be found with a binary search
+        self._hashes = [node[0] for node in nodes]
+        self._lookup = None
+
+        # Zero-copy view of the data section, file data is sliced out of this
+        self.data = self.stream.view[self.data_offset:]
+        if lazy:
+            self.files = [SarcFile(self, (node[1] & 0xffffff) * 4, node[2], node[3]) for node in nodes]
+            return
 
         self.files = []
         for node in nodes:
             file = {}
-            pos = self.stream.tell()
-            self.stream.seek(self.name_table_offset + node["Filename Offset"])
-            file["Name"] = self.stream.read_string()
-            file["Data"] = self.data[node["Data Start"]:node["Data End"]]
-            self.stream.seek(pos)
+            file["Name"] = self.stream.read_string_pool((node[1] & 0xffffff) * 4, self.name_table_offset) # Offset is divided by 4
+            file["Data"] = bytes(self.data[node[2]:node[3]])
             self.files.append(file)
-        
-        self.stream.seek(0, io.SEEK_END)
-        self.size = self.stream.tell()
+        self.data.release()
+        self.stream.close()
+
+    # Creates an archive from (name, size, source) descriptors, see SourceFile for the supported sources
+    # Nothing is read until the archive is written and then only one file is held in memory at a time
+    @classmethod
+    def FromSources(cls, sources, filename=''):
+        archive = cls.__new__(cls)
+        archive.filename = filename
+        archive._InitEmpty()
+        for name, size, source in sources:
+            archive.AddSource(name, source, size)
+        return archive
+
+    def _InitEmpty(self):
+        self.magic = "SARC"
+        self.header_size = 0x14
+        self.bom = None
+        self.version = 0x100
+        self.sfat_magic = "SFAT"
+        self.sfat_header_size = 0x0c
+        self.hash_mult = 101
+        self.sfnt_magic = "SFNT"
+        self.sfnt_header_size = 0x08
+        self.files = []
+        self._hashes = None
+        self._lookup = None
+        self.source_path = None
+
+    # Copies any lazily loaded files out of the source archive and releases it
+    def Materialize(self):
+        for i in range(len(self.files)):
+            file = self.files[i]
+            if isinstance(file, SarcFile):
+                self.files[i] = {"Name" : file["Name"], "Data" : bytes(file["Data"])}
+        # The index would still point at the lazy entries
+        self._lookup = None
+        if hasattr(self, "stream"):
+            self.data.release()
+            try:
+                self.stream.close()
+            except BufferError: # Someone still holds a view of a file, the mapping is freed along with it instead
+                pass
+
+    # Maps file names to entries, built the first time it's needed
+    def _Index(self):
+        if self._lookup is None:
+            self._lookup = {file["Name"] : file for file in self.files}
+        return self._lookup
+
+    # Returns the entry for the specified file or default if it's not in the archive
+    # Until the archive is modified, this only decodes the names of files with a matching hash
+    def get(self, name, default=None):
+        if self._lookup is None and self._hashes is not None and len(self._hashes) == len(self.files):
+            hash = self.Hash(name)
+            i = bisect.bisect_left(self._hashes, hash)
+            while i < len(self._hashes) and self._hashes[i] == hash:
+                if self.files[i]["Name"] == name:
+                    return self.files[i]
+                i += 1
+            return default
+        return self._Index().get(name, default)
+
+    def __contains__(self, name):
+        return self.get(name) is not None
 
     # Converts SARC into directory
-    def ExtractArchive(self, dirname=''):
+    # Directories are created once up front, pass max_workers > 1 (or None for the default) to write files from a thread pool
+    def ExtractArchive(self, dirname='', max_workers=1):
         dirname = os.path.join(dirname, os.path.splitext(self.filename)[0])
-        if not(os.path.exists(dirname)):
-            os.makedirs(dirname)
-        for file in self.files:
-            if not(os.path.exists(os.path.join(dirname, os.path.dirname(file["Name"])))):
-                os.makedirs(os.path.join(dirname, os.path.dirname(file["Name"])))
-            with open(os.path.join(dirname, file["Name"]), 'wb') as outfile:
-                outfile.write(file["Data"])
+        directories = {os.path.normpath(os.path.join(dirname, os.path.dirname(file["Name"]))) for file in self.files}
+        directories.add(os.path.normpath(dirname))
+        for directory in sorted(directories):
+            os.makedirs(directory, exist_ok=True)
+        if max_workers == 1:
+            for file in self.files:
+                self._ExtractFile(file, dirname)
+            return
+        with ThreadPoolExecutor(max_workers) as executor:
+            # Consume the results so errors from the workers are raised here
+            for result in executor.map(lambda file: self._ExtractFile(file, dirname), self.files):
+                pass
+
+    @staticmethod
+    def _ExtractFile(file, dirname):
+        with open(os.path.join(dirname, file["Name"]), 'wb') as outfile:
+            Sarc._WriteData(file, outfile, Sarc._GetSize(file))
 
     # Filename hash algorithm
     def Hash(self, filename):
         hash = 0
-        if type(filename) != bytes:
-            filename = bytearray(filename.encode('utf-8'))
-        if type(filename) != bytearray:
-            filename = bytearray(filename)
+        if type(filename) == str:
+            filename = filename.encode('utf-8')
         for byte in filename:
-            hash = hash * self.hash_mult + byte
-        return hash & 0xFFFFFFFF
+            hash = (hash * self.hash_mult + byte) & 0xFFFFFFFF
+        return hash
     
     # Creates SARC file
-    def CreateArchive(self, filename='', output_dir='', endianness="little"):
-        if endianness.lower() == "little":
-            bom = "<"
-        else:
-            bom = ">"
+    # File data is streamed into the output one file at a time
+    # With dedupe=True, files with identical contents share one copy of the data
+    # The number of bytes saved is returned and kept in dedupe_savings
+    def CreateArchive(self, filename='', output_dir='', endianness="little", dedupe=False):
         if filename == '':
             filename = self.filename
-        with open(os.path.join(output_dir, filename), 'wb+') as outfile:
-            buffer = WriteStream(outfile)
+        path = os.path.join(output_dir, filename)
+        # Lazily loaded files still point into the mapped source, it has to be let go of before it can be replaced
+        if self.source_path is not None and os.path.exists(path) and os.path.samefile(path, self.source_path):
+            self.Materialize()
+        # Written to a temporary file first so a failed write doesn't destroy the existing file
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'wb') as outfile:
+                saved = self._WriteArchive(WriteStream(outfile), endianness, dedupe)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return saved
+
+    # Serializes the archive in memory and returns the file as bytes
+    def ToBytes(self, endianness="little", dedupe=False):
+        buffer = WriteStream()
+        self._WriteArchive(buffer, endianness, dedupe)
+        return buffer.getvalue()
+
+    def _WriteArchive(self, buffer, endianness, dedupe=False):
+        bom = "<" if endianness.lower() == "little" else ">"
+        # Each name is hashed exactly once, the sort is stable so files with colliding hashes keep their order
+        hashed = sorted([(self.Hash(file["Name"]), file) for file in self.files], key=lambda entry: entry[0])
+        self.files = [file for hash, file in hashed]
+        sizes = [self._GetSize(file) for file in self.files]
+        keys = [(size, self._Digest(file, size)) for file, size in zip(self.files, sizes)] if dedupe else None
+        header, ranges = self._BuildHeader([(hash, file["Name"], size) for (hash, file), size in zip(hashed, sizes)], bom, keys)
+        buffer.write(header)
+        data_end = 0
+        saved = 0
+        for file, (start, end) in zip(self.files, ranges):
+            if start < data_end: # Shares the data of an earlier file
+                saved += end - start
+                continue
+            self._WriteData(file, buffer, end - start)
+            buffer.write(bytes(-end % 8))
+            data_end = end + -end % 8
+        self.dedupe_savings = saved
+        return saved
+
+    # Content hash of an entry's data, used to find duplicate files
+    @staticmethod
+    def _Digest(file, size):
+        digest = DigestWriter()
+        Sarc._WriteData(file, digest, size)
+        return digest.digest()
+
+    @staticmethod
+    def _GetSize(file):
+        if isinstance(file, SourceFile):
+            return file.GetSize()
+        if isinstance(file, SarcFile) and not(file.IsLoaded("Data")):
+            return file.end - file.start
+        return len(file["Data"])
+
+    # Writes an entry's data to the output, file sources are copied in chunks rather than read whole
+    @staticmethod
+    def _WriteData(file, buffer, size):
+        start = buffer.tell()
+        if isinstance(file, SourceFile) and not(file.IsLoaded("Data")):
+            if isinstance(file.source, (str, os.PathLike)):
+                with open(file.source, 'rb') as f:
+                    shutil.copyfileobj(f, buffer, 0x100000)
+            elif callable(file.source):
+                buffer.write(file.source())
+            else:
+                buffer.write(file.source)
+        else:
+            buffer.write(file["Data"])
+        if buffer.tell() - start != size:
+            raise ValueError(f"Size of {file['Name']} changed while writing, expected {size} bytes but got {buffer.tell() - start}")
+
+    # Builds everything before the data section from (hash, name, size) entries sorted by hash
+    # Returns the header, SFAT, and SFNT (padded up to the data section) and the data range of each entry
+    # If keys are provided, entries with the same key are given the same data range
+    def _BuildHeader(self, entries, bom, keys=None):
+        sfnt_offset = self.header_size + self.sfat_header_size + 0x10 * len(entries)
+        name_table_offset = sfnt_offset + self.sfnt_header_size
+
+        # Collision flags count up from 1 within each run of identical hashes
+        name_count = {}
+        previous_hash = None
+        for hash, name, size in entries:
+            count = count + 1 if hash == previous_hash else 1
+            previous_hash = hash
+            name_count[name] = count
+
+        name_offsets = {}
+        names = bytearray()
+        for hash, name, size in entries:
+            names += bytes(-len(names) % 4)
+            if name not in name_offsets:
+                name_offsets[name] = len(names) // 4
+                names += string(name) + b'\x00'
+        data_offset = name_table_offset + len(names)
+        data_offset += -data_offset % 8
+        names += bytes(data_offset - name_table_offset - len(names))
+
+        ranges = []
+        shared = {}
+        data_end = 0
+        for i in range(len(entries)):
+            if keys is not None and keys[i] in shared:
+                ranges.append(shared[keys[i]])
+                continue
+            start = data_end + -data_end % 8
+            data_end = start + entries[i][2]
+            ranges.append((start, data_end))
+            if keys is not None:
+                shared[keys[i]] = (start, data_end)
+        filesize = data_offset + data_end + -data_end % 8
+
+        buffer = WriteStream()
+        buffer.write(string(self.magic))
+        buffer.write(u16(self.header_size, bom))
+        buffer.write(b'\xFF\xFE' if bom == "<" else b'\xFE\xFF')
+        buffer.write(u32(filesize, bom))
+        buffer.write(u32(data_offset, bom))
+        buffer.write(u16(self.version, bom))
+        buffer.write(padding(2))
+        buffer.write(string(self.sfat_magic))
+        buffer.write(u16(self.sfat_header_size, bom))
+        buffer.write(u16(len(entries), bom))
+        buffer.write(u32(self.hash_mult, bom))
+        for (hash, name, size), (start, end) in zip(entries, ranges):
+            buffer.write(u32(hash, bom))
+            buffer.write(u32((name_count[name] << 24) + name_offsets[name], bom))
+            buffer.write(u32(start, bom))
+            buffer.write(u32(end, bom))
+        buffer.write(string(self.sfnt_magic))
+        buffer.write(u16(self.sfnt_header_size, bom))
+        buffer.write(padding(2))
+        buffer.write(names)
+        return buffer.getvalue(), ranges
 
-            self.files = sorted(self.files, key=lambda d: self.Hash(d["Name"]))
-            name_count = {}
-            hashes = []
-            for file in self.files:
-                hash = self.Hash(file["Name"])
-                hashes.append(hash)
-                name_count[file["Name"]] = hashes.count(hash)
-            name_offsets = {}
-            buffer.seek(self.header_size + self.sfat_header_size + 0x10 * len(self.files))
-            buffer.write(string(self.sfnt_magic))
-            buffer.write(u16(self.sfnt_header_size, bom))
-            buffer.write(padding(2))
-            name_table_offset = buffer.tell()
-            for file in self.files:
-                buffer.align_up(4)
-                if file["Name"] not in list(name_offsets.keys()):
-                    name_offsets[file["Name"]] = int((buffer.tell() - name_table_offset) / 4)
-                    buffer.write(string(file["Name"]) + b'\x00')
-            buffer.align_up(8)
-            data_offset = buffer.tell()
-            data_offsets = []
-            for file in self.files:
-                start = buffer.tell() - data_offset
-                buffer.write(file["Data"])
-                end = buffer.tell() - data_offset
-                data_offsets.append((start, end))
-                buffer.align_up(8)
-            filesize = buffer.tell()
-            buffer.seek(0)
-            buffer.write(string(self.magic))
-            buffer.write(u16(self.header_size, bom))
-            if bom == "<":
-                buffer.write(b'\xFF\xFE')
-            elif bom == ">":
-                buffer.write(b'\xFE\xFF')
-            buffer.write(u32(filesize, bom))
-            buffer.write(u32(data_offset, bom))
-            buffer.write(u16(self.version, bom))
-            buffer.write(padding(2))
-            buffer.write(string(self.sfat_magic))
-            buffer.write(u16(self.sfat_header_size, bom))
-            buffer.write(u16(len(self.files), bom))
-            buffer.write(u32(self.hash_mult, bom))
-            for file in self.files:
-                buffer.write(u32(self.Hash(file["Name"])))
-                buffer.write(u32((name_count[file["Name"]] << 24) + name_offsets[file["Name"]]))
-                buffer.write(u32(data_offsets[self.files.index(file)][0]))
-                buffer.write(u32(data_offsets[self.files.index(file)][1]))
-    
     # Removes specified file
     def RemoveFile(self, filepath):
-        for file in self.files:
-            if file["Name"] == filepath:
-                self.files.remove(file)
+        file = self._Index().pop(filepath, None)
+        if file is None:
+            return
+        self._hashes = None
+        for i in range(len(self.files)):
+            if self.files[i] is file:
+                del self.files[i]
+                break
     
     # Adds specified file/folder
+    # The file data isn't read until it's accessed or the archive is written
     def AddFile(self, filepath):
         if os.path.isdir(filepath):
             for root_dir, dir, files in os.walk(filepath):
                 for file in files:
-                    file_data = {}
-                    file_data["Name"] = os.path.join(root_dir, file)
-                    with open(os.path.join(root_dir, file), 'rb') as f:
-                        file_data["Data"] = f.read()
-                    self.files.append(file_data)
+                    self.AddSource(os.path.join(root_dir, file), os.path.join(root_dir, file))
         elif os.path.isfile(filepath):
-            with open(filepath, 'rb') as file:
-                self.files.append({"Name" : filepath, "Data" : file.read()})
+            self.AddSource(filepath, filepath)
+
+    # Adds a file whose data comes from a filepath, callable, or bytes-like object
+    # Replaces the existing entry if one with the same name already exists
+    def AddSource(self, name, source, size=None):
+        index = self._Index()
+        file = SourceFile(name, source, size)
+        if name in index:
+            old = index[name]
+            for i in range(len(self.files)):
+                if self.files[i] is old:
+                    self.files[i] = file
+                    break
+        else:
+            self.files.append(file)
+            self._hashes = None
+        index[name] = file
     
     # Replaces specified file with new file
     def ReplaceFile(self, old_file, new_file):
@@ -223,16 +504,26 @@ class Sarc:
     def ListFileInfo(self):
         files = {}
         for file in self.files:
-            files[file["Name"]] = len(file["Data"])
+            files[file["Name"]] = self._GetSize(file)
         return files
     
     # Removes all files in archive
     def ClearArchive(self):
         self.files = []
+        self._lookup = {}
+        self._hashes = None
 
     # Renames specified file
     def RenameFile(self, old_filename, new_filename):
-        self.files[new_filename] = self.files.pop(old_filename)
+        if old_filename == new_filename:
+            return
+        index = self._Index()
+        if new_filename in index:
+            self.RemoveFile(new_filename)
+        file = index.pop(old_filename)
+        file["Name"] = new_filename
+        index[new_filename] = file
+        self._hashes = None
 
     # Returns a string list of all files in archive
     def __repr__(self):
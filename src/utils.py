@@ -1,6 +1,7 @@
 # Largely adapated from https://github.com/zeldamods/evfl
 import struct
-import io
+import os
+import mmap
 import mmh3
 import binascii
 
@@ -19,114 +20,322 @@ class Stream:
     def skip(self, skip_size) -> None:
         self.stream.seek(skip_size, 1)
 
+# Precompiled struct unpackers for each byte order so the typed readers never rebuild format strings
+_structs = {
+    end : {fmt : struct.Struct(end + fmt).unpack_from for fmt in "bBhHiIqQfd"} for end in "<>"
+}
+
 class ReadStream(Stream):
-    def __init__(self, data) -> None:
-        stream = io.BytesIO(memoryview(data))
-        super().__init__(stream)
+    # Cursor over a memoryview of the data, reads don't go through an intermediate file object
+    # owns_data should be set if the data was mapped just for this stream so close() unmaps it
+    def __init__(self, data, owns_data=False) -> None:
         self.data = data
+        self.owns_data = owns_data
+        self.view = memoryview(data).cast("B")
+        self.pos = 0
+        self.size = len(self.view)
+        # bytes, bytearray, and mmap can all search for the null terminator directly
+        self._find = getattr(data, "find", None)
+        super().__init__(self)
+
+    def seek(self, offset, whence=0) -> None:
+        if whence == 0:
+            self.pos = offset
+        elif whence == 1:
+            self.pos += offset
+        else:
+            self.pos = self.size + offset
+
+    def tell(self) -> int:
+        return self.pos
+
+    def skip(self, skip_size) -> None:
+        self.pos += skip_size
+
+    def read(self, size=-1) -> bytes:
+        start = self.pos
+        end = self.size if size is None or size < 0 else min(start + size, self.size)
+        self.pos = max(end, start)
+        return self.view[start:end].tobytes()
+
+    # Same as read() but returns a slice of the underlying buffer instead of a copy
+    def read_view(self, size=-1) -> memoryview:
+        start = self.pos
+        end = self.size if size is None or size < 0 else min(start + size, self.size)
+        self.pos = max(end, start)
+        return self.view[start:end]
 
-    def read(self, *args) -> bytes:
-        return self.stream.read(*args)
-    
     def read_u8(self, end="<") -> int:
-        return struct.unpack(f"{end}B", self.read(1))[0]
-    
+        value = self.view[self.pos]
+        self.pos += 1
+        return value
+
+    def read_s8(self, end="<") -> int:
+        pos = self.pos
+        self.pos = pos + 1
+        return _structs[end]["b"](self.view, pos)[0]
+
     def read_u16(self, end="<") -> int:
-        return struct.unpack(f"{end}H", self.read(2))[0]
-    
+        pos = self.pos
+        self.pos = pos + 2
+        return _structs[end]["H"](self.view, pos)[0]
+
     def read_s16(self, end="<") -> int:
-        return struct.unpack(f"{end}h", self.read(2))[0]
-    
+        pos = self.pos
+        self.pos = pos + 2
+        return _structs[end]["h"](self.view, pos)[0]
+
     def read_u24(self, end="<") -> int:
-        if end == "<":
-            return struct.unpack(f"{end}I", self.read(3) + b'\x00')[0]
-        else:
-            return struct.unpack(f"{end}I", b'\x00' + self.read(3))[0]
-        
+        data = self.view[self.pos:self.pos + 3]
+        if len(data) != 3:
+            raise struct.error("unpack requires a buffer of 3 bytes")
+        self.pos += 3
+        return int.from_bytes(data, "little" if end == "<" else "big")
+
     def read_s24(self, end="<") -> int:
-        if end == "<":
-            return struct.unpack(f"{end}i", self.read(3) + b'\x00')[0]
-        else:
-            return struct.unpack(f"{end}i", b'\x00' + self.read(3))[0]
-    
+        data = self.view[self.pos:self.pos + 3]
+        if len(data) != 3:
+            raise struct.error("unpack requires a buffer of 3 bytes")
+        self.pos += 3
+        return int.from_bytes(data, "little" if end == "<" else "big", signed=True)
+
     def read_u32(self, end="<") -> int:
-        return struct.unpack(f"{end}I", self.read(4))[0]
-    
+        pos = self.pos
+        self.pos = pos + 4
+        return _structs[end]["I"](self.view, pos)[0]
+
     def read_s32(self, end="<") -> int:
-        return struct.unpack(f"{end}i", self.read(4))[0]
-    
+        pos = self.pos
+        self.pos = pos + 4
+        return _structs[end]["i"](self.view, pos)[0]
+
     def read_u64(self, end="<") -> int:
-        return struct.unpack(f"{end}Q", self.read(8))[0]
-    
+        pos = self.pos
+        self.pos = pos + 8
+        return _structs[end]["Q"](self.view, pos)[0]
+
     def read_s64(self, end="<") -> int:
-        return struct.unpack(f"{end}q", self.read(8))[0]
-    
+        pos = self.pos
+        self.pos = pos + 8
+        return _structs[end]["q"](self.view, pos)[0]
+
     def read_ptr(self, align=8, end="<") -> int:
-        while self.stream.tell() % align != 0:
-            self.read(1)
-        return struct.unpack(f"{end}Q", self.read(8))[0]
-    
+        pos = self.pos + -self.pos % align
+        self.pos = pos + 8
+        return _structs[end]["Q"](self.view, pos)[0]
+
     def read_f32(self, end="<") -> float:
-        return struct.unpack(f"{end}f", self.read(4))[0]
-    
+        pos = self.pos
+        self.pos = pos + 4
+        return _structs[end]["f"](self.view, pos)[0]
+
     def read_f64(self, end="<") -> float:
-        return struct.unpack(f"{end}d", self.read(4))[0]
+        pos = self.pos
+        self.pos = pos + 8
+        return _structs[end]["d"](self.view, pos)[0]
+
+    # Bulk readers, these decode an entire table with a single unpack call
+    def read_u8_array(self, count) -> list:
+        values = self.view[self.pos:self.pos + count].tolist()
+        if len(values) != count:
+            raise struct.error(f"unpack requires a buffer of {count} bytes")
+        self.pos += count
+        return values
+
+    def read_u16_array(self, count, end="<") -> tuple:
+        return self.read_array("H", count, end)
+
+    def read_u32_array(self, count, end="<") -> tuple:
+        return self.read_array("I", count, end)
+
+    def read_s32_array(self, count, end="<") -> tuple:
+        return self.read_array("i", count, end)
+
+    def read_f32_array(self, count, end="<") -> tuple:
+        return self.read_array("f", count, end)
+
+    # Reads count values of a single struct format character (e.g. "I")
+    def read_array(self, fmt, count, end="<") -> tuple:
+        values = struct.unpack_from(f"{end}{count}{fmt}", self.view, self.pos)
+        self.pos += struct.calcsize(f"{end}{count}{fmt}")
+        return values
+
+    # Reads count records of the given struct format (e.g. "IIII") and returns a list of tuples
+    def read_struct_array(self, fmt, count, end="<") -> list:
+        record = struct.Struct(end + fmt)
+        size = record.size * count
+        if self.pos + size > self.size:
+            raise struct.error(f"unpack requires a buffer of {size} bytes")
+        values = list(record.iter_unpack(self.view[self.pos:self.pos + size]))
+        self.pos += size
+        return values
+
+    def _find_null(self, start):
+        if self._find is not None:
+            end = self._find(b'\x00', start)
+            return self.size if end == -1 else end
+        # memoryviews can't be searched, so scan in chunks instead
+        pos = start
+        while pos < self.size:
+            end = self.view[pos:pos + 0x100].tobytes().find(b'\x00')
+            if end != -1:
+                return pos + end
+            pos += 0x100
+        return self.size
 
     def read_string(self):
-        string = b''
-        current_char = self.stream.read(1)
-        while current_char != b'\x00':
-            string += current_char
-            current_char = self.stream.read(1)
-        return string.decode('utf-8')
+        end = self._find_null(self.pos)
+        string = self.view[self.pos:end].tobytes().decode('utf-8')
+        self.pos = min(end + 1, self.size)
+        return string
 
+    # Releases the underlying buffer (and unmaps it if it's a file mapped for this stream)
+    # Any memoryviews returned by read_view() must be released first
+    def close(self):
+        self.view.release()
+        if self.owns_data and isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    # Reads a null-terminated string from a string pool without moving the stream position
     def read_string_pool(self, offset, string_pool_offset, end="<"):
-        pos = self.stream.tell()
-        self.stream.seek(string_pool_offset + offset)
-        data = self.read()
-        end = data.find(b'\x00')
-        string = data[offset:end].decode('utf-8')
-        self.stream.seek(pos)
-        return string
+        start = string_pool_offset + offset
+        return self.view[start:self._find_null(start)].tobytes().decode('utf-8')
+
+class StringPool:
+    # Deduplicated pool of null-terminated strings, offsets are relative to the start of the pool
+    def __init__(self):
+        self.strings = [] # List of strings in the pool (insertion order)
+        self.data = bytearray() # Encoded pool
+        self.refs = {} # Maps strings to relative offsets
+
+    def add(self, string):
+        offset = self.refs.get(string)
+        if offset is None:
+            encoded = string.encode()
+            offset = len(self.data)
+            self.refs[string] = offset
+            self.strings.append(string)
+            self.data += encoded
+            if encoded[-1:] != b'\x00': # All strings must end with a null termination character
+                self.data += b'\x00'
+        return offset
+
+    # Returns the finished pool, optionally rebuilt in sorted order
+    # Sorting reassigns offsets so only do it before any offsets have been written
+    def finalize(self, sort=False):
+        if sort:
+            self.strings.sort()
+            data = bytearray()
+            for string in self.strings:
+                encoded = string.encode()
+                self.refs[string] = len(data)
+                data += encoded
+                if encoded[-1:] != b'\x00':
+                    data += b'\x00'
+            self.data[:] = data
+        return bytes(self.data)
 
 class WriteStream(Stream):
-    def __init__(self, stream):
+    # Writes to the provided file object, or to an in-memory bytearray if no stream is given
+    # In-memory output is retrieved with getvalue()
+    def __init__(self, stream=None):
         super().__init__(stream)
-        self._string_list = [] # List of strings in file
-        self._strings = b'' # String pool to write to file
-        self._string_refs = {} # Maps strings to relative offsets
-        self._string_list_exb = [] # List of strings in the EXB Section
-        self._strings_exb = b'' # String pool to write to the EXB section
-        self._string_refs_exb = {} # Maps strings to relative offsets
+        self.buffer = bytearray() if stream is None else None
+        self.pos = 0
+        self._patches = [] # Deferred (offset, data) writes, applied once by resolve_patches()
+        self._string_pool = StringPool()
+        self._string_list = self._string_pool.strings # List of strings in file
+        self._strings = self._string_pool.data # String pool to write to file
+        self._string_refs = self._string_pool.refs # Maps strings to relative offsets
+        self._string_pool_exb = StringPool()
+        self._string_list_exb = self._string_pool_exb.strings # List of strings in the EXB Section
+        self._strings_exb = self._string_pool_exb.data # String pool to write to the EXB section
+        self._string_refs_exb = self._string_pool_exb.refs # Maps strings to relative offsets
 
     def add_string(self, string):
-        if string not in self._string_list:
-            encoded = string.encode()
-            self._string_list.append(string)
-            self._string_refs[string] = len(self._strings)
-            self._strings += encoded
-            if encoded[-1:] != b'\x00': # All strings must end with a null termination character
-                self._strings += b'\x00'
+        return self._string_pool.add(string)
 
     def add_string_exb(self, string):
-        if string not in self._string_list_exb:
-            encoded = string.encode()
-            self._string_list_exb.append(string)
-            self._string_refs_exb[string] = len(self._strings_exb)
-            self._strings_exb += encoded
-            if encoded[-1:] != b'\x00': # All strings must end with a null termination character
-                self._strings_exb += b'\x00'
-    
+        return self._string_pool_exb.add(string)
+
+    # Writes the whole string pool at the current position
+    def write_strings(self, sort=False):
+        self.write(self._string_pool.finalize(sort))
+
+    def write_strings_exb(self, sort=False):
+        self.write(self._string_pool_exb.finalize(sort))
+
+    def seek(self, offset, whence=0) -> None:
+        if self.buffer is None:
+            self.stream.seek(offset, whence)
+        elif whence == 0:
+            self.pos = offset
+        elif whence == 1:
+            self.pos += offset
+        else:
+            self.pos = len(self.buffer) + offset
+
+    def tell(self) -> int:
+        if self.buffer is None:
+            return self.stream.tell()
+        return self.pos
+
+    # In-memory streams are zero-filled when skipping past the end of the buffer
+    def skip(self, skip_size) -> None:
+        if self.buffer is None:
+            self.stream.seek(skip_size, 1)
+            return
+        self.pos += skip_size
+        if self.pos > len(self.buffer):
+            self.buffer += bytes(self.pos - len(self.buffer))
+
     def align_up(self, alignment):
-        while self.stream.tell() % alignment != 0:
-            self.skip(1)
+        self.skip(-self.tell() % alignment)
 
     def write(self, data):
-        self.stream.write(data)
+        if self.buffer is None:
+            self.stream.write(data)
+            return
+        pos = self.pos
+        if pos == len(self.buffer):
+            self.buffer += data
+        else:
+            if pos > len(self.buffer):
+                self.buffer += bytes(pos - len(self.buffer))
+            self.buffer[pos:pos + len(data)] = data
+        self.pos = pos + len(data)
+
+    # Records data to be written at offset once the rest of the output is done (e.g. offsets to later sections)
+    def patch(self, offset, data):
+        self._patches.append((offset, data))
+
+    def resolve_patches(self):
+        if self.buffer is None:
+            pos = self.stream.tell()
+            for offset, data in self._patches:
+                self.stream.seek(offset)
+                self.stream.write(data)
+            self.stream.seek(pos)
+        else:
+            for offset, data in self._patches:
+                self.buffer[offset:offset + len(data)] = data
+        self._patches = []
+
+    # Returns the finished in-memory output
+    def getvalue(self):
+        self.resolve_patches()
+        return bytes(self.buffer)
 
     def read(self, *args):
         self.stream.read(*args)
 
+# Maps a file into memory read-only so only the pages that are actually parsed get read from disk
+def map_file(filepath):
+    with open(filepath, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0: # Empty files can't be mapped
+            return b''
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
 def u8(value):
     return struct.pack("<B", value)
 
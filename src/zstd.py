@@ -3,155 +3,498 @@ try:
 except ImportError:
     raise ImportError("Would you be so kind as to LEARN TO FUCKING READ INSTRUCTIONS")
 import sarc
+import cache
 import os
 import io
+import shutil
+import threading
+import time
+import random
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+# Dictionary used for each file suffix, checked in order after stripping the compression extension
+DICTIONARY_SUFFIXES = [(".bcett.byml", "bcett.byml.zsdic"), (".pack", "pack.zsdic")]
+DEFAULT_DICTIONARY = "zs.zsdic"
+
+# Name of the dictionary for a file from a suffix table like DICTIONARY_SUFFIXES, None if it shouldn't use one
+def MatchDictionary(filepath, suffixes=DICTIONARY_SUFFIXES):
+    filename = os.path.basename(filepath)
+    name, ext = os.path.splitext(filename)
+    if ext in ['.zs', '.zstd']:
+        filename = name
+    if filename == 'ZsDic.pack':
+        return None
+    for suffix, dictionary in suffixes:
+        if filename.endswith(suffix):
+            return dictionary
+    return DEFAULT_DICTIONARY
+
+# Cache used by every Zstd object that isn't given one, see EnableCache
+_cache = None
+
+# Caches decompressed files on disk so they're only decompressed once across runs
+def EnableCache(cache_dir, max_size=4 * 1024 ** 3):
+    global _cache
+    _cache = cache.Cache(cache_dir, max_size)
+    return _cache
+
+def DisableCache():
+    global _cache
+    _cache = None
+
+# Dictionaries from each romfs dump's ZsDic.pack.zs, loaded once and shared by every Zstd object
+_dictionaries = {}
+_dictionaries_lock = threading.Lock()
+
+# Returns a dict of dictionary names to their data
+def LoadDictionaries(romfs_path):
+    path = os.path.abspath(os.path.join(romfs_path, "Pack/ZsDic.pack.zs"))
+    with _dictionaries_lock:
+        if path not in _dictionaries:
+            with open(path, 'rb') as file:
+                data = file.read()
+            archive = sarc.Sarc(zs.ZstdDecompressor().decompress(data))
+            _dictionaries[path] = {file["Name"]: file["Data"] for file in archive.files}
+        return _dictionaries[path]
 
 class Zstd:
     # Initialize decompressor
-    def __init__(self, romfs_path, format=zs.FORMAT_ZSTD1): # zs.FORMAT_ZSTD1_MAGICLESS for headerless
+    # Decompressed files are cached in cache (a cache.Cache) if one is given or enabled with EnableCache
+    # The dictionaries aren't loaded until a file needs one
+    def __init__(self, romfs_path, format=zs.FORMAT_ZSTD1, cache=None): # zs.FORMAT_ZSTD1_MAGICLESS for headerless
+        self.romfs_path = romfs_path
+        self._Setup(None, format, cache)
+
+    # For when the dictionaries have already been loaded, takes a dict of dictionary names to their data
+    @classmethod
+    def FromDictionaries(cls, dictionaries, format=zs.FORMAT_ZSTD1, cache=None):
+        zstd = cls.__new__(cls)
+        zstd.romfs_path = None
+        zstd._Setup(dictionaries, format, cache)
+        return zstd
+
+    def _Setup(self, dictionaries, format, cache=None):
         self.format = format
         self.decompressor = zs.ZstdDecompressor()
-        with open(os.path.join(romfs_path,"Pack/ZsDic.pack.zs"), 'rb') as file:
-            data = file.read()
-        self.dictionaries = self.decompressor.decompress(data)
-        self.dictionaries = sarc.Sarc(self.dictionaries)
-        self.dictionaries = self.dictionaries.files
+        self._dictionaries = dictionaries
+        self.dictionary_suffixes = list(DICTIONARY_SUFFIXES)
+        self.cache = cache if cache is not None else _cache
+        # Contexts aren't thread-safe so each thread keeps its own
+        self._local = threading.local()
+
+    @property
+    def dictionaries(self):
+        if self._dictionaries is None:
+            self._dictionaries = LoadDictionaries(self.romfs_path)
+        return self._dictionaries
+
+    @dictionaries.setter
+    def dictionaries(self, dictionaries):
+        self._dictionaries = dictionaries
+        self._local = threading.local()
+
+    # Name of the dictionary used for a file, None if it shouldn't use one
+    def GetDictionaryName(self, filepath):
+        return MatchDictionary(filepath, self.dictionary_suffixes)
+
+    # Adds a dictionary that's used for files ending in any of the suffixes (after removing .zs)
+    # Registered suffixes are checked before the game's, files compressed with it need it registered to be decompressed
+    def RegisterDictionary(self, name, data, suffixes=[]):
+        # The loaded dictionaries are shared with other objects so they're copied before being modified
+        self.dictionaries = dict(self.dictionaries)
+        self.dictionaries[name] = bytes(data)
+        self.dictionary_suffixes = [(suffix, name) for suffix in suffixes] + \
+                                   [entry for entry in self.dictionary_suffixes if entry[0] not in suffixes]
 
-    # Decompresses specified file to specified location
+    # Contexts are created once per thread and reused for every file using the same settings
+    def _GetLocal(self):
+        local = self._local
+        if not hasattr(local, "contexts"):
+            local.contexts = {}
+            local.dictionaries = {}
+        return local
+
+    # Returns this thread's prepared copy of a dictionary
+    def _GetDictionary(self, name):
+        if name is None:
+            return None
+        dictionaries = self._GetLocal().dictionaries
+        if name not in dictionaries:
+            dictionaries[name] = zs.ZstdCompressionDict(self.dictionaries[name])
+        return dictionaries[name]
+
+    def _GetDecompressor(self, filepath, with_dict):
+        name = self.GetDictionaryName(filepath) if with_dict else None
+        contexts = self._GetLocal().contexts
+        key = ("decompress", name, self.format)
+        if key not in contexts:
+            contexts[key] = zs.ZstdDecompressor(self._GetDictionary(name), format=self.format)
+        return contexts[key]
+
+    # threads > 0 uses zstd's multithreaded compression within each file
+    def _GetCompressor(self, filepath, level, with_dict, threads=0):
+        name = self.GetDictionaryName(filepath) if with_dict else None
+        contexts = self._GetLocal().contexts
+        key = ("compress", name, level, threads, self.format)
+        if key not in contexts:
+            contexts[key] = zs.ZstdCompressor(level, self._GetDictionary(name), threads=threads)
+        return contexts[key]
+
+    # Decompresses specified file to specified location and returns the decompressed data
     def _DecompressFile(self, filepath, output_dir='', with_dict=False, no_output=False):
-        if with_dict and os.path.basename(filepath) != 'ZsDic.pack.zs':
-            if os.path.splitext(os.path.splitext(filepath)[0])[1] == '.pack':
-                for dic in self.dictionaries:
-                    if dic["Name"] == 'pack.zsdic':
-                        dictionary = dic["Data"]
-                        break
-            elif os.path.splitext(os.path.splitext(filepath)[0])[1] == '.byml':
-                if os.path.splitext(os.path.splitext(os.path.splitext(filepath)[0])[0])[1] == '.bcett':
-                    for dic in self.dictionaries:
-                        if dic["Name"] == 'bcett.byml.zsdic':
-                            dictionary = dic["Data"]
-                            break
-                else:
-                    for dic in self.dictionaries:
-                        if dic["Name"] == 'zs.zsdic':
-                            dictionary = dic["Data"]
-                            break
-            else:
-                for dic in self.dictionaries:
-                    if dic["Name"] == 'zs.zsdic':
-                        dictionary = dic["Data"]
-                        break
-            self.decompressor = zs.ZstdDecompressor(zs.ZstdCompressionDict(dictionary), format=self.format)
-        else:
-            self.decompressor = zs.ZstdDecompressor(format=self.format)
-        with open(filepath, 'rb') as file:
-            data = file.read()
-        if os.path.splitext(filepath)[1] in ['.zs', '.zstd']:
-            filepath = os.path.splitext(filepath)[0]
-        else:
+        if os.path.splitext(filepath)[1] not in ['.zs', '.zstd']:
             return
+        data = self.DecompressInto(filepath, with_dict=with_dict)
         if not(no_output):
-            with open(os.path.join(output_dir, os.path.basename(filepath)), 'wb') as file:
-                file.write(self.decompressor.decompress(data))
-        return self.decompressor.decompress(data)
+            with open(os.path.join(output_dir, os.path.basename(os.path.splitext(filepath)[0])), 'wb') as file:
+                file.write(data)
+        return bytes(data)
+
+    # Same as Decompress but the output file is written in chunks instead of holding the data in memory
+    # Returns the decompressed size
+    def DecompressFile(self, filepath, output_dir='', with_dict=True):
+        if os.path.splitext(filepath)[1] not in ['.zs', '.zstd']:
+            return
+        output_path = os.path.join(output_dir, os.path.basename(os.path.splitext(filepath)[0]))
+        cached = self.cache.GetDataPath(filepath) if self.cache is not None else None
+        if cached is not None:
+            try:
+                shutil.copyfile(cached, output_path)
+                return os.path.getsize(output_path)
+            except OSError: # Evicted by another process
+                pass
+        decompressor = self._GetDecompressor(filepath, with_dict)
+        with open(filepath, 'rb') as infile:
+            with open(output_path, 'wb') as outfile:
+                size = decompressor.copy_stream(infile, outfile)[1]
+        if self.cache is not None:
+            self.cache.PutDataFromFile(filepath, output_path)
+        return size
+
+    # Decompresses a file into a bytearray without any intermediate copies
+    # Uses buffer if it's large enough, otherwise a new bytearray is allocated
+    # Returns the buffer or a memoryview of the decompressed part if the buffer is larger than the file
+    def DecompressInto(self, filepath, buffer=None, with_dict=True):
+        cached = self.cache.GetDataPath(filepath) if self.cache is not None else None
+        if cached is not None:
+            try:
+                with open(cached, 'rb') as file:
+                    return self._ReadInto(file, os.path.getsize(cached), buffer, filepath)
+            except OSError: # Evicted by another process
+                pass
+        decompressor = self._GetDecompressor(filepath, with_dict)
+        with open(filepath, 'rb') as file:
+            size = self._GetFrameContentSize(file)
+            file.seek(0)
+            data = self._ReadInto(decompressor.stream_reader(file, closefd=False), size, buffer, filepath)
+        if self.cache is not None:
+            self.cache.PutData(filepath, data)
+        return data
 
-    # Decompresses a file or directory
-    def Decompress(self, filepath, output_dir='', with_dict=True, no_output=False):
+    # Decompresses data that's already in memory, filepath is only used to pick the dictionary
+    def DecompressData(self, data, filepath, with_dict=True):
+        size = self._GetFrameContentSize(io.BytesIO(data[:18]))
+        return self._ReadInto(self._GetDecompressor(filepath, with_dict).stream_reader(data), size, None, filepath)
+
+    # Reads everything from reader into buffer, size is None if it isn't known ahead of time
+    @staticmethod
+    def _ReadInto(reader, size, buffer, filepath):
+        if size is None: # The buffer has to grow as data is read
+            if buffer is None:
+                buffer = bytearray()
+            size = 0
+            while True:
+                chunk = reader.read(zs.DECOMPRESSION_RECOMMENDED_OUTPUT_SIZE)
+                if not(chunk):
+                    break
+                buffer[size:size + len(chunk)] = chunk
+                size += len(chunk)
+        else:
+            if buffer is None or len(buffer) < size:
+                buffer = bytearray(size)
+            view = memoryview(buffer).cast("B")
+            pos = 0
+            while pos < size:
+                count = reader.readinto(view[pos:size])
+                if count == 0:
+                    raise ValueError(f"{filepath} ended after {pos} of {size} bytes")
+                pos += count
+        if len(buffer) == size:
+            return buffer
+        return memoryview(buffer).cast("B")[:size]
+
+    # Decompressed size from the header of the frame at the file's current position, None if it isn't stored
+    def _GetFrameContentSize(self, file):
+        header = file.read(18) # Maximum frame header size
+        try:
+            size = zs.get_frame_parameters(header, self.format).content_size
+        except zs.ZstdError:
+            return None
+        if size in [zs.CONTENTSIZE_UNKNOWN, zs.CONTENTSIZE_ERROR]:
+            return None
+        return size
+
+    # Decompresses a file or directory, a single file returns the decompressed data
+    # Directories are decompressed over a process pool, see _ProcessTree
+    # Files in directories are streamed to the output with DecompressFile unless no_output is set
+    def Decompress(self, filepath, output_dir='', with_dict=True, no_output=False, workers=None, chunksize=16, progress=None):
         if os.path.isfile(filepath):
             return self._DecompressFile(filepath, output_dir, with_dict, no_output)
         elif os.path.isdir(filepath):
-            for root_dir, dir, files in os.walk(filepath):
-                for file in files:
-                    if os.path.isfile(os.path.join(root_dir, file)):
-                        rel_path = os.path.relpath(root_dir, filepath)
-                        if not(os.path.exists(os.path.join(output_dir, rel_path))):
-                            os.makedirs(os.path.join(output_dir, rel_path))
-                        return self._DecompressFile(os.path.join(root_dir, file), os.path.join(output_dir, rel_path), with_dict, no_output)
+            method, args = ("_DecompressFile", (with_dict, True)) if no_output else ("DecompressFile", (with_dict,))
+            return self._ProcessTree(filepath, output_dir, method, args, no_output,
+                                     lambda file: os.path.splitext(file)[1] in ['.zs', '.zstd'], workers, chunksize, progress)
 
     # Get size of decompressed file
+    # Read from the frame header when possible, otherwise the file is decompressed without keeping the output
     def GetDecompressedSize(self, filepath, with_dict=True):
+        if os.path.splitext(filepath)[1] not in ['.zs', '.zstd']:
+            return os.path.getsize(filepath)
         with open(filepath, 'rb') as file:
-            if os.path.splitext(filepath)[1] in ['.zs', '.zstd']:
-                if os.path.splitext(filepath)[1] == '.mc':
-                    file.seek(0xc)
-                data = file.read()
-                if with_dict:
-                    if os.path.splitext(os.path.splitext(filepath)[0])[1] == '.pack':
-                        for dic in self.dictionaries:
-                            if dic["Name"] == 'pack.zsdic':
-                                dictionary = dic["Data"]
-                                break
-                    elif os.path.splitext(os.path.splitext(filepath)[0])[1] == '.byml':
-                        if os.path.splitext(os.path.splitext(os.path.splitext(filepath)[0])[0])[1] == '.bcett':
-                            for dic in self.dictionaries:
-                                if dic["Name"] == 'bcett.byml.zsdic':
-                                    dictionary = dic["Data"]
-                                    break
-                        else:
-                            for dic in self.dictionaries:
-                                if dic["Name"] == 'zs.zsdic':
-                                    dictionary = dic["Data"]
-                                    break
-                    else:
-                        for dic in self.dictionaries:
-                            if dic["Name"] == 'zs.zsdic':
-                                dictionary = dic["Data"]
-                                break
-                    self.decompressor = zs.ZstdDecompressor(zs.ZstdCompressionDict(dictionary), format=self.format)
-                else:
-                    self.decompressor = zs.ZstdDecompressor(format=self.format)
-                return len(self.decompressor.decompress(data))
-            else:
-                file.seek(0, io.SEEK_END)
-                return file.tell()
+            size = self._GetFrameContentSize(file)
+            if size is not None:
+                return size
+            if self.cache is not None:
+                size = self.cache.GetValue(filepath, "size")
+                if size is not None:
+                    return size
+            file.seek(0)
+            size = 0
+            reader = self._GetDecompressor(filepath, with_dict).stream_reader(file, closefd=False)
+            while True:
+                chunk = reader.read(zs.DECOMPRESSION_RECOMMENDED_OUTPUT_SIZE)
+                if not(chunk):
+                    break
+                size += len(chunk)
+        if self.cache is not None:
+            self.cache.PutValue(filepath, "size", size)
+        return size
 
     # Compresses file to specified location
-    def _CompressFile(self, filepath, output_dir='', level=16, with_dict=False):
-        if with_dict and os.path.basename(filepath) != 'ZsDic.pack.zs':
-            if os.path.splitext(os.path.splitext(filepath)[0])[1] == '.pack':
-                for dic in self.dictionaries:
-                    if dic["Name"] == 'pack.zsdic':
-                        dictionary = dic["Data"]
-                        break
-            elif os.path.splitext(os.path.splitext(filepath)[0])[1] == '.byml':
-                if os.path.splitext(os.path.splitext(os.path.splitext(filepath)[0])[0])[1] == '.bcett':
-                    for dic in self.dictionaries:
-                        if dic["Name"] == 'bcett.byml.zsdic':
-                            dictionary = dic["Data"]
-                            break
-                else:
-                    for dic in self.dictionaries:
-                        if dic["Name"] == 'zs.zsdic':
-                            dictionary = dic["Data"]
-                            break
-            else:
-                for dic in self.dictionaries:
-                    if dic["Name"] == 'zs.zsdic':
-                        dictionary = dic["Data"]
-                        break
-            self.compressor = zs.ZstdCompressor(level, zs.ZstdCompressionDict(dictionary))
-        else:
-            self.compressor = zs.ZstdCompressor(level)
+    def _CompressFile(self, filepath, output_dir='', level=16, with_dict=False, threads=0):
+        compressor = self._GetCompressor(filepath, level, with_dict, threads)
         with open(filepath, 'rb') as file:
-            data = file.read()
-        filepath += '.zs'
-        with open(os.path.join(output_dir, os.path.basename(filepath)), 'wb') as file:
-            if self.format == zs.FORMAT_ZSTD1_MAGICLESS:
-                file.write(self.compressor.compress(data)[4:])
-                return self.compressor.compress(data)[4:]
-            else:
-                file.write(self.compressor.compress(data))
-                return self.compressor.compress(data)
-    
+            data = compressor.compress(file.read())
+        if self.format == zs.FORMAT_ZSTD1_MAGICLESS:
+            data = data[4:]
+        with open(os.path.join(output_dir, os.path.basename(filepath) + '.zs'), 'wb') as file:
+            file.write(data)
+        return data
+
     # Compresses file or files and maintains directory structure
-    def Compress(self, filepath, output_dir='', level=16, with_dict=True):
+    def Compress(self, filepath, output_dir='', level=16, with_dict=True, workers=None, chunksize=16, progress=None, threads=0):
         if os.path.isfile(filepath):
-            return self._CompressFile(filepath, output_dir, level, with_dict)
+            return self._CompressFile(filepath, output_dir, level, with_dict, threads)
         elif os.path.isdir(filepath):
-            for root_dir, dir, files in os.walk(filepath):
-                for file in files:
-                    if os.path.isfile(os.path.join(root_dir, file)):
-                        rel_path = os.path.relpath(root_dir, filepath)
-                        if not(os.path.exists(os.path.join(output_dir, rel_path))):
-                            os.makedirs(os.path.join(output_dir, rel_path))
-                        return self._CompressFile(os.path.join(root_dir, file), os.path.join(output_dir, rel_path), level, with_dict)
\ No newline at end of file
+            return self._ProcessTree(filepath, output_dir, "_CompressFile", (level, with_dict, threads), False,
+                                     lambda file: True, workers, chunksize, progress)
+
+    # Compresses a sample of files for each dictionary at each level and prints the ratio and speed
+    # Paths can be files or directories, compressed files are decompressed first
+    # Returns a list of results with one entry per dictionary and level
+    def Benchmark(self, paths, levels=[1, 3, 6, 9, 12, 16, 19], sample=50, threads=0, with_dict=True):
+        groups = {}
+        for file in _ListFiles(paths):
+            name = self.GetDictionaryName(file) if with_dict else None
+            if name is not None or not(with_dict):
+                groups.setdefault(name, []).append(file)
+        results = []
+        print(f"{'Dictionary':<20}{'Level':>6}{'Files':>7}{'Ratio':>8}{'Comp MB/s':>12}{'Decomp MB/s':>13}")
+        for name, files in groups.items():
+            files = sorted(random.Random(0).sample(files, min(sample, len(files))))
+            samples = [self._ReadSample(file, with_dict) for file in files]
+            # The first file stands in for the group since they all use the same dictionary
+            decompressor = self._GetDecompressor(files[0], with_dict)
+            size = sum(len(data) for data in samples)
+            for level in levels:
+                compressor = self._GetCompressor(files[0], level, with_dict, threads)
+                start = time.perf_counter()
+                compressed = [compressor.compress(data) for data in samples]
+                compress_time = time.perf_counter() - start
+                start = time.perf_counter()
+                for data in compressed:
+                    decompressor.decompress(data)
+                decompress_time = time.perf_counter() - start
+                compressed_size = sum(len(data) for data in compressed)
+                result = {
+                    "Dictionary": name,
+                    "Level": level,
+                    "Files": len(samples),
+                    "Size": size,
+                    "Compressed Size": compressed_size,
+                    "Ratio": size / compressed_size,
+                    "Compression Speed": size / 1000000 / compress_time if compress_time else float('inf'),
+                    "Decompression Speed": size / 1000000 / decompress_time if decompress_time else float('inf')
+                }
+                results.append(result)
+                print(f"{str(name):<20}{level:>6}{len(samples):>7}{result['Ratio']:>8.3f}"
+                      f"{result['Compression Speed']:>12.1f}{result['Decompression Speed']:>13.1f}")
+        return results
+
+    # Decompressed contents of a file used for benchmarking or training
+    def _ReadSample(self, filepath, with_dict=True):
+        if os.path.splitext(filepath)[1] in ['.zs', '.zstd']:
+            return bytes(self.DecompressInto(filepath, with_dict=with_dict))
+        with open(filepath, 'rb') as file:
+            return file.read()
+
+    # Trains a dictionary on the files in paths and returns its data, compressed files are decompressed first
+    # holdout is the fraction of files kept out of training to compare the result against the game's dictionaries
+    def TrainDictionary(self, paths, size=112640, holdout=0.1, level=16):
+        files = [file for file in _ListFiles(paths) if os.path.basename(file) != 'ZsDic.pack.zs']
+        random.Random(0).shuffle(files)
+        held_out = files[:int(len(files) * holdout)]
+        training = files[len(held_out):]
+        dictionary = zs.train_dictionary(size, [self._ReadSample(file) for file in training], level=level)
+        if held_out:
+            self.CompareDictionaries(held_out, dictionary.as_bytes(), level)
+        return dictionary.as_bytes()
+
+    # Compares compressing files with a dictionary against the game's dictionary for each file and no dictionary
+    # Prints and returns the total compressed size and decompression speed for each
+    def CompareDictionaries(self, paths, dictionary, level=16):
+        files = [file for file in _ListFiles(paths) if os.path.basename(file) != 'ZsDic.pack.zs']
+        samples = [self._ReadSample(file) for file in files]
+        size = sum(len(data) for data in samples)
+        trained = zs.ZstdCompressionDict(dictionary)
+        contexts = {
+            "None": (zs.ZstdCompressor(level), zs.ZstdDecompressor()),
+            "Trained": (zs.ZstdCompressor(level, trained), zs.ZstdDecompressor(trained))
+        }
+        vanilla = {}
+        results = []
+        print(f"{'Dictionary':<12}{'Files':>7}{'Size':>14}{'Compressed':>14}{'Ratio':>8}{'Decomp MB/s':>13}")
+        for name in ["None", "Vanilla", "Trained"]:
+            compressed = []
+            for file, data in zip(files, samples):
+                if name == "Vanilla":
+                    dictionary_name = MatchDictionary(file)
+                    if dictionary_name not in vanilla:
+                        prepared = self._GetDictionary(dictionary_name)
+                        vanilla[dictionary_name] = (zs.ZstdCompressor(level, prepared), zs.ZstdDecompressor(prepared))
+                    compressor, decompressor = vanilla[dictionary_name]
+                else:
+                    compressor, decompressor = contexts[name]
+                compressed.append((compressor.compress(data), decompressor))
+            start = time.perf_counter()
+            for data, decompressor in compressed:
+                decompressor.decompress(data)
+            decompress_time = time.perf_counter() - start
+            compressed_size = sum(len(data) for data, decompressor in compressed)
+            result = {
+                "Dictionary": name,
+                "Files": len(files),
+                "Size": size,
+                "Compressed Size": compressed_size,
+                "Ratio": size / compressed_size if compressed_size else 0,
+                "Decompression Speed": size / 1000000 / decompress_time if decompress_time else float('inf')
+            }
+            results.append(result)
+            print(f"{name:<12}{len(files):>7}{size:>14}{compressed_size:>14}{result['Ratio']:>8.3f}{result['Decompression Speed']:>13.1f}")
+        return results
+
+    # Runs method on every matching file in a directory, output keeps the same directory structure
+    # Files are sent to the workers in chunks of chunksize and progress(done, total) is called after each file
+    # Returns a dict of relative paths to the file data if keep_data is set, otherwise to the output size
+    def _ProcessTree(self, dirpath, output_dir, method, args, keep_data, include, workers=None, chunksize=16, progress=None):
+        jobs = []
+        rel_paths = []
+        output_dirs = set()
+        for root_dir, dir, files in os.walk(dirpath):
+            rel_dir = os.path.relpath(root_dir, dirpath)
+            for file in files:
+                if include(file):
+                    jobs.append((method, os.path.join(root_dir, file), os.path.join(output_dir, rel_dir), args, keep_data))
+                    rel_paths.append(os.path.normpath(os.path.join(rel_dir, file)))
+                    output_dirs.add(os.path.join(output_dir, rel_dir))
+        if not(keep_data):
+            for path in sorted(output_dirs):
+                os.makedirs(path, exist_ok=True)
+        if workers is None:
+            workers = os.cpu_count() or 1
+        results = {}
+        if workers == 1 or len(jobs) <= chunksize:
+            outputs = (_RunJob(self, job) for job in jobs)
+            pool = None
+        else:
+            dictionaries = {name: bytes(data) for name, data in self.dictionaries.items()}
+            pool = ProcessPoolExecutor(workers, initializer=_InitWorker, initargs=(dictionaries, self.format, self.cache, self.dictionary_suffixes))
+            outputs = pool.map(_RunWorkerJob, jobs, chunksize=chunksize)
+        try:
+            for i, output in enumerate(outputs):
+                results[rel_paths[i]] = output
+                if progress is not None:
+                    progress(i + 1, len(jobs))
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+        return results
+
+# Files in a list of files and directories
+def _ListFiles(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += [os.path.join(root_dir, file) for root_dir, dir, names in os.walk(path) for file in names]
+        else:
+            files.append(path)
+    return files
+
+# Each worker process keeps its own Zstd object so contexts are only created once per process
+_worker = None
+
+def _InitWorker(dictionaries, format, cache=None, suffixes=DICTIONARY_SUFFIXES):
+    global _worker
+    _worker = Zstd.FromDictionaries(dictionaries, format, cache)
+    _worker.dictionary_suffixes = suffixes
+
+def _RunWorkerJob(job):
+    return _RunJob(_worker, job)
+
+def _RunJob(zstd, job):
+    method, filepath, output_dir, args, keep_data = job
+    result = getattr(zstd, method)(filepath, output_dir, *args)
+    if keep_data or isinstance(result, int):
+        return result
+    return len(result)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compress, decompress, and benchmark files using the game's zstd dictionaries")
+    parser.add_argument("romfs_path", help="romfs dump containing Pack/ZsDic.pack.zs")
+    commands = parser.add_subparsers(dest="command", required=True)
+    decompress = commands.add_parser("decompress", help="decompress a file or directory")
+    decompress.add_argument("path")
+    decompress.add_argument("-o", "--output", default='')
+    decompress.add_argument("-j", "--workers", type=int, default=None)
+    compress = commands.add_parser("compress", help="compress a file or directory")
+    compress.add_argument("path")
+    compress.add_argument("-o", "--output", default='')
+    compress.add_argument("-l", "--level", type=int, default=16)
+    compress.add_argument("-t", "--threads", type=int, default=0, help="zstd worker threads per file")
+    compress.add_argument("-j", "--workers", type=int, default=None)
+    benchmark = commands.add_parser("benchmark", help="compare compression levels for each dictionary")
+    benchmark.add_argument("paths", nargs="+")
+    benchmark.add_argument("-l", "--levels", type=int, nargs="+", default=[1, 3, 6, 9, 12, 16, 19])
+    benchmark.add_argument("-n", "--sample", type=int, default=50, help="files per dictionary")
+    benchmark.add_argument("-t", "--threads", type=int, default=0)
+    train = commands.add_parser("train", help="train a dictionary and compare it to the game's dictionaries")
+    train.add_argument("paths", nargs="+")
+    train.add_argument("-o", "--output", required=True)
+    train.add_argument("-s", "--size", type=int, default=112640, help="dictionary size in bytes")
+    train.add_argument("-l", "--level", type=int, default=16)
+    train.add_argument("--holdout", type=float, default=0.1, help="fraction of files used for the comparison")
+    args = parser.parse_args()
+    zstd = Zstd(args.romfs_path)
+    if args.command == "decompress":
+        if os.path.isfile(args.path):
+            zstd.DecompressFile(args.path, args.output)
+        else:
+            zstd.Decompress(args.path, args.output, workers=args.workers)
+    elif args.command == "compress":
+        zstd.Compress(args.path, args.output, args.level, workers=args.workers, threads=args.threads)
+    elif args.command == "benchmark":
+        zstd.Benchmark(args.paths, args.levels, args.sample, args.threads)
+    else:
+        with open(args.output, 'wb') as file:
+            file.write(zstd.TrainDictionary(args.paths, args.size, args.holdout, args.level))